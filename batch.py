@@ -0,0 +1,369 @@
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import http_client
+from find_adj import find_adjacent_valid_artworks, build_pixiv_artwork_url
+from metrics import Metrics, serve_prometheus
+from page_parser import fetch_artwork_info
+from probe_cache import ProbeCache
+from probe_engine import ProbeEngine, DEFAULT_CONCURRENCY
+from rate_control import AdaptiveRateController
+from resource_downloader import download_pixiv_gallery
+from time_index import TimeIndex, INDEX_WINDOW_LIMIT
+from search import search_artwork, search_cluster, extract_neighbor_ids, DEFAULT_EXTENSIONS
+
+# Job statuses; finished jobs are skipped when a run is restarted
+STATUS_FOUND = 'found'
+STATUS_NOT_FOUND = 'not_found'
+# Not found, but some candidates never got an answer; searched again on the next run
+STATUS_INCOMPLETE = 'incomplete'
+STATUS_NEEDS_URIS = 'needs_uris'
+STATUS_ERROR = 'error'
+FINISHED_STATUSES = (STATUS_FOUND, STATUS_NOT_FOUND)
+
+Job = Tuple[int, Optional[str], Optional[str]]
+
+
+def read_jobs(path: str) -> List[Job]:
+    """
+    Read one job per line: an artwork ID, optionally followed by the previous
+    and next neighbor img-original URIs (separated by commas or whitespace).
+    Blank lines and lines starting with # are ignored.
+    """
+    jobs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = [field for field in re.split(r'[,\s]+', line) if field]
+            if not fields[0].isdigit() or len(fields) not in (1, 3):
+                raise ValueError(f"{path}:{line_no}: expected 'ID' or 'ID, prev URI, next URI'")
+            if len(fields) == 3:
+                jobs.append((int(fields[0]), fields[1], fields[2]))
+            else:
+                jobs.append((int(fields[0]), None, None))
+    return jobs
+
+
+def load_finished(path: str) -> Dict[int, dict]:
+    """Read the results file of an earlier run, keeping only finished jobs."""
+    finished = {}
+    if not os.path.exists(path):
+        return finished
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 上次运行被中断时可能留下不完整的最后一行
+                continue
+            if record.get('status') in FINISHED_STATUSES:
+                finished[record['artwork_id']] = record
+    return finished
+
+
+class ResultWriter:
+    """Append one JSON line per finished job, flushed to disk immediately."""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class BatchRunner:
+    """
+    Run search jobs from a queue under one concurrency and rate budget.
+
+    Queued targets that turn out to share a job's two neighbors are taken
+    along and swept together with search_cluster.
+    """
+
+    def __init__(self, writer: ResultWriter, cache: ProbeCache, jobs: int = 2,
+                 concurrency: int = DEFAULT_CONCURRENCY, extensions=DEFAULT_EXTENSIONS,
+                 download_dir: Optional[str] = None, verbose: bool = False,
+                 metrics: Optional[Metrics] = None, index: Optional[TimeIndex] = None,
+                 two_phase: bool = False):
+        self.writer = writer
+        self.cache = cache
+        self.jobs = max(1, jobs)
+        # 总并发在同时运行的作业之间平均分配
+        self.per_job_concurrency = max(1, concurrency // self.jobs)
+        self.extensions = list(extensions)
+        self.download_dir = download_dir
+        self.verbose = verbose
+        # Single-target jobs locate the upload time through the img-master preview first
+        self.two_phase = two_phase
+        # Known upload times; brackets new targets and grows with every search
+        self.index = index
+        # Counters across all jobs, for the Prometheus endpoint
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.status_counts: Dict[str, int] = {}
+        self._pending: List[Job] = []
+        self._queue_lock = threading.Lock()
+        self._engines = set()
+        self._engines_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def run(self, jobs: List[Job]):
+        with self._queue_lock:
+            self._pending.extend(jobs)
+        workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.jobs)]
+        for worker in workers:
+            worker.start()
+        try:
+            while any(worker.is_alive() for worker in workers):
+                for worker in workers:
+                    worker.join(timeout=0.5)
+        except KeyboardInterrupt:
+            print("\n正在停止，已完成的结果和扫描断点已保存...")
+            self.stop()
+            for worker in workers:
+                worker.join(timeout=5)
+            raise
+
+    def stop(self):
+        self._stopping.set()
+        with self._engines_lock:
+            for engine in self._engines:
+                engine.stop()
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            job = self._take_job()
+            if job is None:
+                return
+            for record in self._run_job(*job):
+                if self._stopping.is_set() and record['status'] != STATUS_FOUND:
+                    # 被中断的作业不记录结果，下次运行时从断点继续
+                    continue
+                self.writer.write(record)
+                with self._engines_lock:
+                    self.status_counts[record['status']] = self.status_counts.get(record['status'], 0) + 1
+                controller = http_client.get_rate_controller()
+                rate = f", {controller.current_rate:.0f} req/s" if controller else ""
+                print(f"[{record['artwork_id']}] {record['status']}"
+                      + (f" -> {record['url']}" if record.get('url') else "")
+                      + f" ({record['probes']} probes, {record['elapsed']:.1f}s{rate})")
+
+    def _log_for(self, artwork_id: int):
+        if not self.verbose:
+            return lambda message: None
+        return lambda message: print(f"[{artwork_id}] {message}")
+
+    def prometheus(self) -> str:
+        """Run-wide metrics plus the rate controller's state and job counts."""
+        with self._engines_lock:
+            extra = {f'jobs_{status}': count for status, count in self.status_counts.items()}
+            extra['jobs_running'] = len(self._engines)
+        controller = http_client.get_rate_controller()
+        if controller is not None:
+            snapshot = controller.snapshot()
+            extra.update(rate_limit=snapshot['rate'], concurrency_limit=snapshot['concurrency_limit'],
+                         in_flight=snapshot['in_flight'], throttled_total=snapshot['throttled'])
+        return self.metrics.to_prometheus(extra=extra)
+
+    def _take_job(self) -> Optional[Job]:
+        with self._queue_lock:
+            return self._pending.pop(0) if self._pending else None
+
+    def _claim_cluster(self, prev_id: int, next_id: int, prev_uri: str, next_uri: str) -> List[int]:
+        """
+        Take the queued jobs between the same two neighbors out of the queue.
+
+        Every ID between two adjacent valid artworks has those same neighbors,
+        so these targets share one upload window and are swept together.
+        """
+        with self._queue_lock:
+            claimed = [job for job in self._pending
+                       if prev_id < job[0] < next_id and (job[1] is None or (job[1], job[2]) == (prev_uri, next_uri))]
+            self._pending = [job for job in self._pending if job not in claimed]
+        return [job[0] for job in claimed]
+
+    def _run_job(self, artwork_id: int, prev_uri: Optional[str], next_uri: Optional[str]) -> List[dict]:
+        started = time.time()
+
+        def new_record(target_id: int) -> dict:
+            return {'artwork_id': target_id, 'status': STATUS_ERROR, 'url': None, 'timestamp': None,
+                    'format': None, 'probes': 0, 'elapsed': 0.0}
+
+        records = [new_record(artwork_id)]
+        job_uris = (prev_uri, next_uri)
+        try:
+            known = None
+            if (not prev_uri or not next_uri) and self.index is not None:
+                known = self.index.bracket_uris(artwork_id, max_window=INDEX_WINDOW_LIMIT)
+            if known:
+                # 索引中已有足够窄的时间范围，无需查找相邻作品
+                prev_uri, next_uri = known
+            elif not prev_uri or not next_uri:
+                prev_id, next_id = find_adjacent_valid_artworks(
+                    artwork_id, concurrency=self.per_job_concurrency, cache=self.cache,
+                    on_page=self.index.add_page if self.index is not None else None)
+                prev_info = fetch_artwork_info(prev_id) if prev_id else None
+                next_info = fetch_artwork_info(next_id) if next_id else None
+                if not prev_info or not next_info:
+                    records[0]['status'] = STATUS_NEEDS_URIS
+                    records[0]['prev_artwork'] = build_pixiv_artwork_url(prev_id) if prev_id else None
+                    records[0]['next_artwork'] = build_pixiv_artwork_url(next_id) if next_id else None
+                    return records
+                prev_uri, next_uri = prev_info.uri, next_info.uri
+
+            if self.index is not None:
+                self.index.add_uri(prev_uri)
+                self.index.add_uri(next_uri)
+                # 索引中可能有更近的已知作品（例如之前找到的已删除作品）
+                tighter = self.index.bracket_uris(artwork_id)
+                if tighter and extract_neighbor_ids(*tighter) != extract_neighbor_ids(prev_uri, next_uri):
+                    prev_uri, next_uri = tighter
+            if job_uris != (prev_uri, next_uri):
+                records[0]['prev_uri'], records[0]['next_uri'] = prev_uri, next_uri
+            neighbor_ids = extract_neighbor_ids(prev_uri, next_uri)
+
+            if neighbor_ids:
+                claim_uris = job_uris if all(job_uris) else (prev_uri, next_uri)
+                for target_id in self._claim_cluster(neighbor_ids[0], neighbor_ids[1], *claim_uris):
+                    record = new_record(target_id)
+                    record['prev_uri'], record['next_uri'] = prev_uri, next_uri
+                    records.append(record)
+            target_ids = [record['artwork_id'] for record in records]
+
+            engine = ProbeEngine(concurrency=self.per_job_concurrency, cache=self.cache)
+            with self._engines_lock:
+                self._engines.add(engine)
+            try:
+                if len(records) == 1:
+                    results = {artwork_id: search_artwork(artwork_id, prev_uri, next_uri, self.extensions,
+                                                          engine=engine, log=self._log_for(artwork_id),
+                                                          two_phase=self.two_phase)}
+                else:
+                    print(f"[{artwork_id}] 与 {len(records) - 1} 个相同相邻作品之间的作品合并搜索: "
+                          f"{', '.join(map(str, sorted(target_ids)))}")
+                    results = search_cluster(target_ids, prev_uri, next_uri, self.extensions,
+                                             engine=engine, log=self._log_for(artwork_id))
+            finally:
+                with self._engines_lock:
+                    self._engines.discard(engine)
+
+            # 合并搜索的作品共享同一份请求统计；两阶段搜索的统计包含两次探测
+            summary = results[records[0]['artwork_id']].metrics
+            for record in records:
+                result = results[record['artwork_id']]
+                record['probes'] = result.probes
+                if len(records) > 1:
+                    record['cluster'] = sorted(target_ids)
+                if result.found:
+                    record.update(status=STATUS_FOUND, url=result.url, format=result.extension,
+                                  timestamp=result.timestamp.isoformat())
+                    if self.index is not None:
+                        self.index.add(result.target_id, result.timestamp)
+                    if self.download_dir:
+                        pages = download_pixiv_gallery(result.url, self.download_dir)
+                        record['pages'] = len(pages)
+                        record['pages_downloaded'] = sum(1 for page in pages if page.ok)
+                        downloaded = sum(page.size for page in pages)
+                        engine.metrics.add_bytes(downloaded)
+                        self.metrics.add_bytes(downloaded)
+                        summary['bytes_downloaded'] += downloaded
+                else:
+                    record['status'] = STATUS_INCOMPLETE if result.unresolved else STATUS_NOT_FOUND
+                    if result.unresolved:
+                        record['unresolved'] = result.unresolved
+                    if result.timestamp is not None:
+                        # 两阶段搜索找到了预览图，但所选格式中没有原图
+                        record['timestamp'] = result.timestamp.isoformat()
+                        if self.index is not None:
+                            self.index.add(result.target_id, result.timestamp)
+            if self.index is not None:
+                self.index.save()
+            for record in records:
+                record['metrics'] = summary
+        except Exception as e:
+            for record in records:
+                record['error'] = f"{type(e).__name__}: {e}"
+        finally:
+            for record in records:
+                record['elapsed'] = round(time.time() - started, 3)
+        return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search many deleted Pixiv artworks without the GUI.")
+    parser.add_argument('targets', help="file with one 'ID' or 'ID, prev URI, next URI' per line")
+    parser.add_argument('-o', '--output', default='results.jsonl',
+                        help="results file, one JSON line per job; finished jobs in it are skipped on restart")
+    parser.add_argument('-j', '--jobs', type=int, default=2, help="artworks searched at the same time")
+    parser.add_argument('-c', '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help="total concurrent requests across all jobs")
+    parser.add_argument('-r', '--rate', type=float, default=500.0,
+                        help="maximum requests per second across all jobs; the actual rate adapts "
+                             "to throttling below this")
+    parser.add_argument('-f', '--formats', default=','.join(DEFAULT_EXTENSIONS),
+                        help="comma separated file formats to search")
+    parser.add_argument('-d', '--download-dir', default=None, help="download found galleries here")
+    parser.add_argument('--two-phase', action='store_true',
+                        help="sweep each window once for the img-master preview, then check the formats "
+                             "at the second found")
+    parser.add_argument('-v', '--verbose', action='store_true', help="print each job's search log")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve Prometheus-style metrics at http://127.0.0.1:PORT/metrics while running")
+    args = parser.parse_args(argv)
+
+    jobs = read_jobs(args.targets)
+    finished = load_finished(args.output)
+    pending = [job for job in jobs if job[0] not in finished]
+    print(f"共 {len(jobs)} 个作品，已完成 {len(jobs) - len(pending)} 个，待处理 {len(pending)} 个")
+
+    http_client.set_rate_controller(AdaptiveRateController(
+        initial_rate=min(100.0, args.rate), max_rate=args.rate, max_concurrency=args.concurrency))
+    http_client.ensure_pool_size(args.concurrency)
+
+    # 统计所有请求，包括相邻作品查找和下载
+    run_metrics = Metrics()
+    http_client.add_request_observer(run_metrics)
+
+    cache = ProbeCache()
+    index = TimeIndex()
+    print(f"时间索引中已知 {len(index)} 个作品的上传时间")
+    writer = ResultWriter(args.output)
+    runner = BatchRunner(writer, cache, jobs=args.jobs, concurrency=args.concurrency,
+                         extensions=[ext.strip().lower() for ext in args.formats.split(',') if ext.strip()],
+                         download_dir=args.download_dir, verbose=args.verbose, metrics=run_metrics,
+                         index=index, two_phase=args.two_phase)
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = serve_prometheus(runner.prometheus, args.metrics_port)
+        print(f"指标地址: http://127.0.0.1:{args.metrics_port}/metrics")
+    try:
+        runner.run(pending)
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        print(f"请求统计: {run_metrics.status_line()}")
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        http_client.remove_request_observer(run_metrics)
+        index.save()
+        writer.close()
+        cache.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,283 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, asdict, field
+from typing import Callable, Dict, List, Optional
+
+import http_client
+from find_adj import find_adjacent_valid_artworks, CHECK_PAGE
+from find_resource import check_pixiv_image_existence
+from mock_pixiv import MockArtwork, MockPixivServer
+from probe_engine import ProbeEngine, DEFAULT_CONCURRENCY
+from rate_control import AdaptiveRateController
+from resource_downloader import download_pixiv_gallery
+from scheduler import URL_TIME_FORMAT
+from search import search_artwork
+
+BENCHMARKS = ('sweep', 'search', 'two-phase', 'adjacent', 'adjacent-page', 'download')
+# Timestamp sweeps, which should get faster with more concurrency (see --check-scaling)
+SCALING_BENCHMARKS = ('sweep', 'search', 'two-phase')
+# The highest concurrency level must take at most this share of the lowest level's time
+SCALING_MAX_RATIO = 0.8
+
+
+@dataclass
+class Scenario:
+    """A deleted target hidden between two visible neighbors on the mock server."""
+    target: MockArtwork
+    prev: MockArtwork
+    next: MockArtwork
+
+    @property
+    def artworks(self) -> List[MockArtwork]:
+        return [self.prev, self.target, self.next]
+
+
+def build_scenario(window: int = 1800, id_gap: int = 40, pages: int = 8, extension: str = 'png',
+                   page_size: int = 262144, seed: int = 0) -> Scenario:
+    """
+    Place the target's upload time at a seeded random second of the window
+    and its neighbors id_gap IDs away, with nothing in between.
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime(2025, 7, 12, 12, 0, 0)
+    target_id = 130000000
+    prev = MockArtwork(target_id - id_gap, start)
+    next_ = MockArtwork(target_id + id_gap, start + datetime.timedelta(seconds=window))
+    target = MockArtwork(target_id, start + datetime.timedelta(seconds=rng.randrange(1, window)),
+                         extension, pages=pages, visible=False, page_size=page_size)
+    return Scenario(target, prev, next_)
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of values, None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+class RequestRecorder:
+    """Collect every http_client request's status and latency during one benchmark."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.first_hit: Optional[float] = None
+
+    def __call__(self, method, url, status, elapsed, error):
+        with self._lock:
+            self.latencies.append(elapsed)
+            key = str(status) if status is not None else type(error).__name__
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+            if self.first_hit is None and status in (200, 206) and '/img-original/' in url:
+                self.first_hit = time.perf_counter() - self.started
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    concurrency: int
+    seconds: float
+    requests: int
+    probes_per_sec: float
+    time_to_first_hit: Optional[float]
+    bytes: int
+    p50_ms: Optional[float]
+    p99_ms: Optional[float]
+    ok: bool
+    statuses: Dict[str, int] = field(default_factory=dict)
+
+
+def run_benchmark(name: str, body: Callable[[], bool], server: MockPixivServer, concurrency: int,
+                  max_rate: float) -> BenchmarkResult:
+    """Run body against the server with a fresh rate controller and measure it."""
+    if max_rate > 0:
+        http_client.set_rate_controller(AdaptiveRateController(
+            initial_rate=min(100.0, max_rate), max_rate=max_rate, max_concurrency=max(128, concurrency)))
+    else:
+        http_client.set_rate_controller(None)
+    http_client.ensure_pool_size(concurrency)
+    server.reset_stats()
+    recorder = RequestRecorder()
+    http_client.add_request_observer(recorder)
+    try:
+        # 被测函数的逐条输出不计入结果
+        with contextlib.redirect_stdout(io.StringIO()):
+            ok = bool(body())
+    finally:
+        http_client.remove_request_observer(recorder)
+    seconds = time.perf_counter() - recorder.started
+    requests = len(recorder.latencies)
+    p50, p99 = percentile(recorder.latencies, 0.5), percentile(recorder.latencies, 0.99)
+    return BenchmarkResult(
+        name=name, concurrency=concurrency, seconds=round(seconds, 3), requests=requests,
+        probes_per_sec=round(requests / seconds, 1) if seconds else 0.0,
+        time_to_first_hit=round(recorder.first_hit, 3) if recorder.first_hit is not None else None,
+        bytes=server.stats()['bytes_sent'],
+        p50_ms=round(p50 * 1000, 2) if p50 is not None else None,
+        p99_ms=round(p99 * 1000, 2) if p99 is not None else None,
+        ok=ok, statuses=dict(sorted(recorder.statuses.items())))
+
+
+def benchmark_bodies(scenario: Scenario, concurrency: int, workdir: str) -> Dict[str, Callable[[], bool]]:
+    """The code paths under test; each returns whether it produced the expected answer."""
+    target = scenario.target
+    prev_time, next_time = scenario.prev.upload_time, scenario.next.upload_time
+
+    def sweep():
+        found = check_pixiv_image_existence(
+            "https://i.pximg.net/img-original/img/{datetime}/",
+            prev_time.strftime(URL_TIME_FORMAT), next_time.strftime(URL_TIME_FORMAT),
+            f"{target.artwork_id}_p0.{target.extension}", concurrency=concurrency)
+        return found == [target.upload_time.strftime('%Y-%m-%d %H:%M:%S')]
+
+    def search():
+        # 与 GUI 的 search_worker 使用相同的参数
+        result = search_artwork(target.artwork_id, scenario.prev.image_url(), scenario.next.image_url(),
+                                ['jpg', 'png'], engine=ProbeEngine(concurrency=concurrency),
+                                log=lambda message: None)
+        return result.url == target.image_url()
+
+    def two_phase():
+        result = search_artwork(target.artwork_id, scenario.prev.image_url(), scenario.next.image_url(),
+                                ['jpg', 'png'], engine=ProbeEngine(concurrency=concurrency),
+                                log=lambda message: None, two_phase=True)
+        return result.url == target.image_url()
+
+    def adjacent():
+        found = find_adjacent_valid_artworks(target.artwork_id, concurrency=concurrency)
+        return found == (scenario.prev.artwork_id, scenario.next.artwork_id)
+
+    def adjacent_page():
+        # 每个 ID 都下载整个作品页面（旧的检查方式），用于对比
+        found = find_adjacent_valid_artworks(target.artwork_id, concurrency=concurrency, methods=(CHECK_PAGE,))
+        return found == (scenario.prev.artwork_id, scenario.next.artwork_id)
+
+    def download():
+        download_dir = tempfile.mkdtemp(dir=workdir)
+        pages = download_pixiv_gallery(target.image_url(), download_dir, workers=min(concurrency, 8))
+        return len(pages) == target.pages and all(page.ok for page in pages)
+
+    return {'sweep': sweep, 'search': search, 'two-phase': two_phase, 'adjacent': adjacent,
+            'adjacent-page': adjacent_page, 'download': download}
+
+
+def format_table(results: List[BenchmarkResult]) -> str:
+    def show(value, suffix=''):
+        return '-' if value is None else f"{value}{suffix}"
+
+    header = f"{'benchmark':<13} {'conc':>5} {'time':>8} {'reqs':>7} {'req/s':>8} {'1st hit':>8} " \
+             f"{'bytes':>11} {'p50':>9} {'p99':>9}  ok"
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append(f"{r.name:<13} {r.concurrency:>5} {r.seconds:>7.2f}s {r.requests:>7} {r.probes_per_sec:>8} "
+                     f"{show(r.time_to_first_hit, 's'):>8} {r.bytes:>11} {show(r.p50_ms, 'ms'):>9} "
+                     f"{show(r.p99_ms, 'ms'):>9}  {'yes' if r.ok else 'NO'}")
+    return '\n'.join(lines)
+
+
+def check_scaling(results: List[BenchmarkResult]) -> List[str]:
+    """
+    Compare each sweep benchmark at its lowest and highest concurrency level;
+    returns a line per benchmark that did not get clearly faster.
+    """
+    failures = []
+    for name in SCALING_BENCHMARKS:
+        runs = sorted((r for r in results if r.name == name), key=lambda r: r.concurrency)
+        if len(runs) < 2 or runs[0].concurrency == runs[-1].concurrency:
+            continue
+        low, high = runs[0], runs[-1]
+        if high.seconds > low.seconds * SCALING_MAX_RATIO:
+            failures.append(f"{name}: {high.seconds:.2f}s at concurrency {high.concurrency} vs "
+                            f"{low.seconds:.2f}s at {low.concurrency}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sweep, searches, adjacent lookup and downloader "
+                                                 "against a local mock of i.pximg.net and pixiv.net.")
+    parser.add_argument('benchmarks', nargs='*',
+                        help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument('-c', '--concurrency', default=str(DEFAULT_CONCURRENCY),
+                        help="comma separated concurrency levels, each benchmark runs once per level")
+    parser.add_argument('--latency', type=float, default=20.0, help="server latency per request in ms")
+    parser.add_argument('--jitter', type=float, default=10.0, help="extra random latency up to this many ms")
+    parser.add_argument('--window', type=int, default=1800, help="seconds between the two neighbors")
+    parser.add_argument('--pages', type=int, default=8, help="pages in the target gallery")
+    parser.add_argument('--page-size', type=int, default=262144, help="bytes per gallery page")
+    parser.add_argument('--html-size', type=int, default=0,
+                        help="bytes artwork pages are padded to (real pages are 100 KB or more)")
+    parser.add_argument('--forbidden-rate', type=float, default=0.0, help="share of image requests answered 403")
+    parser.add_argument('--server-rate', type=float, default=None,
+                        help="requests per second the server allows before answering 429")
+    parser.add_argument('--max-rate', type=float, default=500.0,
+                        help="client rate controller ceiling in requests per second; 0 disables pacing")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the hidden timestamp and jitter")
+    parser.add_argument('--check-scaling', action='store_true',
+                        help="fail unless the sweeps are clearly faster at the highest concurrency level "
+                             "than at the lowest (needs at least two levels)")
+    parser.add_argument('--json', dest='json_path', default=None, help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    names = [name for name in BENCHMARKS if not args.benchmarks or name in args.benchmarks]
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    if args.check_scaling and len(set(levels)) < 2:
+        parser.error("--check-scaling needs at least two concurrency levels, e.g. -c 8,32")
+    scenario = build_scenario(args.window, pages=args.pages, page_size=args.page_size, seed=args.seed)
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+
+    results = []
+    previous_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # 在临时目录中运行，学习到的格式和时间统计、下载的文件都不会留在项目中
+        os.chdir(workdir)
+        server = MockPixivServer(scenario.artworks, latency=args.latency / 1000, jitter=args.jitter / 1000,
+                                 forbidden_rate=args.forbidden_rate, rate_limit=args.server_rate, seed=args.seed,
+                                 html_size=args.html_size)
+        try:
+            with server:
+                for concurrency in levels:
+                    bodies = benchmark_bodies(scenario, concurrency, workdir)
+                    for name in names:
+                        result = run_benchmark(name, bodies[name], server, concurrency, args.max_rate)
+                        results.append(result)
+                        print(f"{name} @ {concurrency}: {result.seconds:.2f}s, {result.requests} requests", file=sys.stderr)
+        finally:
+            os.chdir(previous_dir)
+
+    hidden_offset = int((scenario.target.upload_time - scenario.prev.upload_time).total_seconds())
+    print(f"Window {args.window}s, target hidden at +{hidden_offset}s, {args.pages} pages, "
+          f"latency {args.latency:g}+{args.jitter:g}ms\n")
+    print(format_table(results))
+
+    scaling_failures = check_scaling(results) if args.check_scaling else []
+    if args.check_scaling:
+        print()
+        for line in scaling_failures:
+            print(f"NOT SCALING  {line}")
+        if not scaling_failures:
+            print("Scaling OK: the sweeps are faster at higher concurrency")
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'settings': vars(args), 'hidden_offset': hidden_offset,
+                       'results': [asdict(result) for result in results]}, f, indent=2)
+    return 0 if all(result.ok for result in results) and not scaling_failures else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from scheduler import parse_uri_datetime
+
+# Inside the download directory: the manifest and the content-addressed objects
+STORE_DIR = '.store'
+MANIFEST_FILE = 'manifest.sqlite3'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_PAGE_PATTERN = re.compile(r'/(\d+)_p(\d+)(\.\w+)$')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    artwork_id INTEGER NOT NULL,
+    page INTEGER NOT NULL,
+    upload_time TEXT,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    added_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_by_artwork ON pages (artwork_id, page);
+CREATE INDEX IF NOT EXISTS pages_by_hash ON pages (sha256);
+CREATE TABLE IF NOT EXISTS galleries (
+    gallery TEXT PRIMARY KEY,
+    page_count INTEGER NOT NULL
+);
+'''
+
+
+@dataclass
+class StoredPage:
+    """One manifest entry: a downloaded page and the object holding its bytes."""
+    url: str
+    artwork_id: int
+    page: int
+    upload_time: Optional[str]
+    size: int
+    sha256: str
+    object_path: str
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link(source: str, destination: str):
+    """Hard-link destination to source, copying where links are not supported."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class DownloadStore:
+    """
+    Content-addressed store for downloaded pages, with a SQLite manifest.
+
+    Every page is kept once under .store/objects/, named by the SHA-256 of its
+    bytes; the files in the download directory are hard links to these
+    objects, so the same content downloaded again (another run, another
+    target leading to the same work) takes no extra space. The manifest maps
+    each source URL to its artwork ID, page, upload time, size and hash, and
+    remembers gallery page counts, so a gallery already on disk is recognized
+    without any request.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.root = os.path.join(directory, STORE_DIR)
+        os.makedirs(os.path.join(self.root, 'objects'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.root, MANIFEST_FILE), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def object_path(self, sha256: str, extension: str) -> str:
+        return os.path.join(self.root, 'objects', sha256[:2], sha256 + extension)
+
+    def lookup(self, url: str) -> Optional[StoredPage]:
+        """The manifest entry for url, or None if it was never stored or its object is gone."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT url, artwork_id, page, upload_time, size, sha256 FROM pages WHERE url = ?',
+                (url,)).fetchone()
+        if row is None:
+            return None
+        match = _PAGE_PATTERN.search(url)
+        entry = StoredPage(*row, object_path=self.object_path(row[5], match.group(3) if match else ''))
+        if not os.path.exists(entry.object_path):
+            with self._lock, self._conn:
+                self._conn.execute('DELETE FROM pages WHERE url = ?', (url,))
+            return None
+        return entry
+
+    def materialize(self, entry: StoredPage, destination: str):
+        """Make destination a link to the entry's object unless a file is already there."""
+        if not os.path.exists(destination):
+            os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+            _link(entry.object_path, destination)
+
+    def add(self, temp_path: str, destination: str, url: str, sha256: Optional[str] = None,
+            keep_source: bool = False) -> bool:
+        """
+        Store a complete file for url and link it to destination.
+
+        The file is moved into the objects (linked instead with keep_source).
+        Returns True if the same content was already stored, in which case the
+        file is dropped and destination links to the existing object.
+        """
+        sha256 = sha256 or hash_file(temp_path)
+        size = os.path.getsize(temp_path)
+        match = _PAGE_PATTERN.search(url)
+        object_path = self.object_path(sha256, match.group(3) if match else '')
+        duplicate = os.path.exists(object_path)
+        if not duplicate:
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            if keep_source:
+                _link(temp_path, object_path)
+            else:
+                os.replace(temp_path, object_path)
+        elif not keep_source:
+            os.remove(temp_path)
+
+        if not os.path.exists(destination):
+            _link(object_path, destination)
+        elif not os.path.samefile(object_path, destination):
+            # 同样的内容已有一份，目标文件改为指向它的链接
+            os.remove(destination)
+            _link(object_path, destination)
+
+        upload_time = parse_uri_datetime(url)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, int(match.group(1)) if match else 0, int(match.group(2)) if match else 0,
+                 upload_time.isoformat() if upload_time else None, size, sha256, time.time()))
+        return duplicate
+
+    def gallery_pages(self, gallery: str) -> Optional[int]:
+        """Page count of a gallery downloaded completely before, None if unknown."""
+        with self._lock:
+            row = self._conn.execute('SELECT page_count FROM galleries WHERE gallery = ?', (gallery,)).fetchone()
+        return row[0] if row else None
+
+    def record_gallery(self, gallery: str, page_count: int):
+        """
+        Remember a gallery as complete. Later runs trust this count without any
+        request, so it must end at a page that answered 404 and every page
+        before it must be stored.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO galleries VALUES (?, ?)', (gallery, page_count))
+
+    def stats(self) -> dict:
+        """Pages in the manifest against the unique content actually on disk."""
+        with self._lock:
+            pages, page_bytes = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages').fetchone()
+            unique, unique_bytes = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM '
+                '(SELECT sha256, MAX(size) AS size FROM pages GROUP BY sha256)').fetchone()
+        return {'pages': pages, 'bytes': page_bytes, 'unique_objects': unique, 'unique_bytes': unique_bytes}
+
+
+_stores: Dict[str, DownloadStore] = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(directory: str) -> DownloadStore:
+    """The shared store of a download directory, opened once per process."""
+    key = os.path.abspath(directory)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = DownloadStore(directory)
+        return store
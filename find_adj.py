@@ -1,88 +1,295 @@
-import requests
-import re
-from typing import Tuple, Optional
-
-
-def build_pixiv_artwork_url(artwork_id: int) -> str:
-    """Build complete Pixiv artwork URL from artwork ID."""
-    return f"https://www.pixiv.net/en/artworks/{artwork_id}"
-
-
-def is_valid_artwork_page(html_content: str) -> bool:
-    """Check if the page contains valid artwork content (no 'Page not found')."""
-    return '<h1>Page not found</h1>' not in html_content
-
-
-def get_artwork_page_content(artwork_id: int) -> Optional[str]:
-    """Get HTML content of Pixiv artwork page. Returns None if 404 or other error."""
-    url = build_pixiv_artwork_url(artwork_id)
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1'
-    }
-    
-    response = requests.get(url, headers=headers, timeout=10)
-    if response.status_code == 404:
-        return None
-    response.raise_for_status()
-    
-    # 确保正确解码内容
-    if response.encoding is None:
-        response.encoding = 'utf-8'
-    
-    return response.text
-
-
-def find_adjacent_valid_artworks(center_id: int) -> Tuple[int, int]:
-    """Find previous and next valid artwork IDs around the center ID."""
-    print(f"寻找作品 {center_id} 的前后相邻作品...")
-    
-    # Find previous valid artwork
-    prev_id = center_id - 1
-    while prev_id > 0:
-        print(f"检查前一个作品: {prev_id}")
-        content = get_artwork_page_content(prev_id)
-        if content is None:
-            print(f"❌ 作品 {prev_id} 不存在 (404)")
-            prev_id -= 1
-            continue
-        if is_valid_artwork_page(content):
-            print(f"✅ 找到前一个有效作品: {prev_id}")
-            break
-        prev_id -= 1
-    
-    # Find next valid artwork
-    next_id = center_id + 1
-    while next_id < 999999999:  # reasonable upper limit
-        print(f"检查后一个作品: {next_id}")
-        content = get_artwork_page_content(next_id)
-        if content is None:
-            print(f"❌ 作品 {next_id} 不存在 (404)")
-            next_id += 1
-            continue
-        if is_valid_artwork_page(content):
-            print(f"✅ 找到后一个有效作品: {next_id}")
-            break
-        next_id += 1
-    
-    return prev_id, next_id
-
-
-if __name__ == '__main__':
-    # --- 请在这里配置您的参数 ---
-    
-    # 给定的 Pixiv 作品 ID
-    ARTWORK_ID = 123456789
-    
-    # --- 执行查找 ---
-    prev_id, next_id = find_adjacent_valid_artworks(ARTWORK_ID)
-    
-    print(f"\n=== 结果汇总 ===")
-    print(f"中心作品 ID: {ARTWORK_ID}")
-    print(f"前一个作品 ID: {prev_id}")
-    print(f"前一个作品 URL: {build_pixiv_artwork_url(prev_id)}")
-    print(f"后一个作品 ID: {next_id}")
-    print(f"后一个作品 URL: {build_pixiv_artwork_url(next_id)}") 
\ No newline at end of file
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Sequence, Tuple, Optional
+
+import requests
+
+import http_client
+from probe_cache import ProbeCache
+
+# Existence checks, from the smallest response to the largest
+CHECK_JSON = 'json'      # the compact /ajax/illust/<id> endpoint
+CHECK_STREAM = 'stream'  # the artwork page, read only until the answer is known
+CHECK_PAGE = 'page'      # the whole artwork page (the original behaviour)
+CHECK_METHODS = (CHECK_JSON, CHECK_STREAM, CHECK_PAGE)
+
+# Tried in order until one gives a definite answer
+DEFAULT_CHECK_METHODS = (CHECK_JSON, CHECK_STREAM)
+
+# An ID whose existence could not be checked is tried this many more times
+UNKNOWN_RETRIES = 2
+
+# Page markers that settle a streamed check before the whole page is read
+_NOT_FOUND_MARKER = '<h1>Page not found</h1>'
+_VALID_MARKERS = ('meta-preload-data', '__NEXT_DATA__')
+STREAM_CHUNK_SIZE = 4096
+
+
+def build_pixiv_artwork_url(artwork_id: int) -> str:
+    """Build complete Pixiv artwork URL from artwork ID."""
+    return f"https://www.pixiv.net/en/artworks/{artwork_id}"
+
+
+def is_valid_artwork_page(html_content: str) -> bool:
+    """Check if the page contains valid artwork content (no 'Page not found')."""
+    return _NOT_FOUND_MARKER not in html_content
+
+
+def get_artwork_page_content(artwork_id: int) -> Optional[str]:
+    """Get HTML content of Pixiv artwork page. Returns None if 404 or other error."""
+    url = build_pixiv_artwork_url(artwork_id)
+    response = http_client.get(url, headers=http_client.PAGE_HEADERS)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    
+    # 确保正确解码内容
+    if response.encoding is None:
+        response.encoding = 'utf-8'
+    
+    return response.text
+
+
+def _check_json(artwork_id: int) -> Tuple[Optional[bool], Optional[str]]:
+    """Ask the illust JSON endpoint; None when the answer is not a pixiv JSON document."""
+    response = http_client.get(f"https://www.pixiv.net/ajax/illust/{artwork_id}", headers=http_client.JSON_HEADERS)
+    try:
+        document = json.loads(response.text)
+    except ValueError:
+        return None, None
+    if not isinstance(document, dict) or 'error' not in document:
+        return None, None
+    if document['error'] or not document.get('body'):
+        # 已删除或不存在的作品返回 404 和 error: true，其他错误交给下一种检查
+        return (False, None) if response.status_code == 404 else (None, None)
+    return True, response.text
+
+
+def _check_stream(artwork_id: int) -> Tuple[Optional[bool], Optional[str]]:
+    """Read the artwork page only until a marker settles it, or to the end if none does."""
+    url = build_pixiv_artwork_url(artwork_id)
+    response = http_client.get(url, headers=http_client.PAGE_HEADERS, stream=True)
+    with response:
+        if response.status_code == 404:
+            return False, None
+        response.raise_for_status()
+        response.encoding = response.encoding or 'utf-8'
+        content = ''
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE, decode_unicode=True):
+            content += chunk
+            if _NOT_FOUND_MARKER in content:
+                return False, None
+            if any(marker in content for marker in _VALID_MARKERS):
+                # 页面其余部分不再下载
+                return True, content
+    return is_valid_artwork_page(content), content
+
+
+def _check_page(artwork_id: int) -> Tuple[Optional[bool], Optional[str]]:
+    content = get_artwork_page_content(artwork_id)
+    valid = content is not None and is_valid_artwork_page(content)
+    return valid, content if valid else None
+
+
+_CHECKS = {CHECK_JSON: _check_json, CHECK_STREAM: _check_stream, CHECK_PAGE: _check_page}
+
+
+def check_artwork(artwork_id: int,
+                  methods: Sequence[str] = DEFAULT_CHECK_METHODS) -> Tuple[Optional[bool], Optional[str]]:
+    """
+    Check whether an artwork exists, using the cheapest method that answers.
+
+    Methods are tried in order and a method that cannot tell (an unexpected
+    response or a network error) falls through to the next; the whole page
+    is the last resort unless it was among the methods. Returns (valid, body),
+    where body is the JSON or (possibly partial) HTML read for a valid
+    artwork, and valid is None when no method could tell.
+    """
+    for method in methods:
+        if method not in _CHECKS:
+            raise ValueError(f"Unknown existence check: {method}")
+    for method in methods:
+        try:
+            valid, body = _CHECKS[method](artwork_id)
+        except requests.exceptions.RequestException:
+            continue
+        if valid is not None:
+            return valid, body
+    if CHECK_PAGE in methods:
+        # 整页已经读取过且失败，不再重复请求
+        return None, None
+    try:
+        return _check_page(artwork_id)
+    except requests.exceptions.RequestException:
+        return None, None
+
+
+def artwork_exists(artwork_id: int, methods: Sequence[str] = DEFAULT_CHECK_METHODS) -> bool:
+    """Check whether the artwork exists and shows a valid artwork (False when that is unknown)."""
+    return bool(check_artwork(artwork_id, methods)[0])
+
+
+class _DirectionSearch:
+    """Search state for one side of the center ID."""
+
+    def __init__(self, center_id: int, step: int, label: str, max_distance: int):
+        self.center_id = center_id
+        self.step = step
+        self.label = label
+        self.max_distance = max_distance
+        self.next_distance = 1
+        self.batch = 1
+        self.in_flight = 0
+        self.invalid = set()
+        self.unknown = set()   # distances whose existence could not be checked
+        self.nearest_valid = None  # distance of the closest valid ID seen so far
+        self.done = False
+
+    def candidate_id(self, distance: int) -> int:
+        return self.center_id + self.step * distance
+
+    def can_submit(self) -> bool:
+        if self.done or self.in_flight >= self.batch or self.next_distance > self.max_distance:
+            return False
+        if self.nearest_valid is not None and self.next_distance >= self.nearest_valid:
+            return False
+        return self.candidate_id(self.next_distance) > 0
+
+    def record(self, distance: int, valid: bool):
+        self.in_flight -= 1
+        if valid:
+            if self.nearest_valid is None or distance < self.nearest_valid:
+                self.nearest_valid = distance
+        else:
+            self.invalid.add(distance)
+            # 连续缺失时加大批量 (galloping)
+            if self.nearest_valid is None:
+                self.batch *= 2
+
+    def proven(self) -> bool:
+        """The nearest valid ID is proven once every closer ID is known to be invalid."""
+        if self.nearest_valid is None:
+            return False
+        return all(d in self.invalid for d in range(1, self.nearest_valid))
+
+
+def find_adjacent_valid_artworks(center_id: int, concurrency: int = 8,
+                                 max_distance: int = 10000,
+                                 max_requests: int = 2000,
+                                 cache: Optional[ProbeCache] = None,
+                                 stop: Optional[threading.Event] = None,
+                                 on_page: Optional[Callable[[int, str], None]] = None,
+                                 methods: Sequence[str] = DEFAULT_CHECK_METHODS) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Find previous and next valid artwork IDs around the center ID.
+
+    Both directions are searched at the same time. Each side starts with a single
+    request and doubles its batch after every miss, up to concurrency. A side
+    finishes as soon as its closest valid ID is proven nearest. Returns None for a
+    side when nothing is found within max_distance IDs or max_requests requests.
+    Artwork existence already in the cache is reused without a request.
+    Setting stop abandons the requests in flight and ends the search early.
+    Existence is checked with check_artwork using methods. on_page is called
+    with (artwork_id, body) for every valid artwork, body being the illust
+    JSON or the page HTML that was read.
+    """
+    print(f"寻找作品 {center_id} 的前后相邻作品...")
+
+    sides = [
+        _DirectionSearch(center_id, -1, "前一个", max_distance),
+        _DirectionSearch(center_id, 1, "后一个", max_distance),
+    ]
+    def check(artwork_id: int) -> Optional[bool]:
+        if cache is not None:
+            known = cache.get_artwork(artwork_id)
+            if known is not None:
+                return known
+        valid, content = check_artwork(artwork_id, methods)
+        if valid and content is not None and on_page is not None:
+            on_page(artwork_id, content)
+        if cache is not None and valid is not None:
+            cache.put_artwork(artwork_id, valid)
+        return valid
+
+    http_client.ensure_pool_size(concurrency)
+    requests_sent = 0
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        while stop is None or not stop.is_set():
+            for side in sides:
+                side.batch = min(side.batch, concurrency)
+                while side.can_submit() and requests_sent < max_requests:
+                    distance = side.next_distance
+                    side.next_distance += 1
+                    side.in_flight += 1
+                    requests_sent += 1
+                    artwork_id = side.candidate_id(distance)
+                    print(f"检查{side.label}作品: {artwork_id}")
+                    pending[executor.submit(check, artwork_id)] = (side, distance, 0)
+
+            if not pending:
+                break
+
+            # 定期醒来检查是否被取消
+            done, _ = wait(pending, timeout=0.2 if stop is not None else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                side, distance, retries = pending.pop(future)
+                artwork_id = side.candidate_id(distance)
+                valid = future.result()
+                if valid is None:
+                    if retries < UNKNOWN_RETRIES and requests_sent < max_requests:
+                        print(f"⚠️ 无法确认作品 {artwork_id} 是否存在，重试")
+                        requests_sent += 1
+                        pending[executor.submit(check, artwork_id)] = (side, distance, retries + 1)
+                        continue
+                    # 仍然无法确认：不算作不存在，更远的有效作品因此无法被证明是最近的
+                    print(f"⚠️ 无法确认作品 {artwork_id} 是否存在")
+                    side.in_flight -= 1
+                    side.unknown.add(distance)
+                    continue
+                side.record(distance, valid)
+                if not valid:
+                    print(f"❌ 作品 {artwork_id} 不存在")
+                if not side.done and side.proven():
+                    side.done = True
+                    print(f"✅ 找到{side.label}有效作品: {side.candidate_id(side.nearest_valid)}")
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+    results = []
+    for side in sides:
+        if side.done:
+            results.append(side.candidate_id(side.nearest_valid))
+        else:
+            if side.unknown:
+                print(f"⚠️ {side.label}方向有 {len(side.unknown)} 个作品无法确认是否存在，请稍后重试")
+            else:
+                print(f"❌ 在限制范围内没有找到{side.label}有效作品")
+            results.append(None)
+    prev_id, next_id = results
+    print(f"共发送请求: {requests_sent}")
+    return prev_id, next_id
+
+
+if __name__ == '__main__':
+    # --- 请在这里配置您的参数 ---
+    
+    # 给定的 Pixiv 作品 ID
+    ARTWORK_ID = 123456789
+    
+    # --- 执行查找 ---
+    prev_id, next_id = find_adjacent_valid_artworks(ARTWORK_ID)
+    
+    print(f"\n=== 结果汇总 ===")
+    print(f"中心作品 ID: {ARTWORK_ID}")
+    if prev_id is not None:
+        print(f"前一个作品 ID: {prev_id}")
+        print(f"前一个作品 URL: {build_pixiv_artwork_url(prev_id)}")
+    if next_id is not None:
+        print(f"后一个作品 ID: {next_id}")
+        print(f"后一个作品 URL: {build_pixiv_artwork_url(next_id)}") 
\ No newline at end of file
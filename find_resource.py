@@ -1,95 +1,146 @@
-import requests
-import datetime
-import time
-
-def check_pixiv_image_existence(base_url_template, start_time_str, end_time_str, image_id):
-    """
-    在指定时间范围内逐秒检查 Pixiv 图片资源是否存在。
-
-    :param base_url_template: 包含日期和 {time} 占位符的 URL 模板。
-                              例如: "https://i.pximg.net/img-original/img/2025/06/08/{time}/"
-    :param start_time_str: 开始时间，格式为 "HH:MM:SS" 或 "HH/MM/SS"。
-    :param end_time_str: 结束时间，格式为 "HH:MM:SS" 或 "HH/MM/SS"。
-    :param image_id: 图片的文件名，例如: "123456789_p0.png"。
-    """
-    
-    # 标准化时间字符串格式，替换 "/" 为 ":"
-    start_time_str = start_time_str.replace('/', ':')
-    end_time_str = end_time_str.replace('/', ':')
-
-    # 将时间字符串解析为 datetime 对象
-    try:
-        start_time = datetime.datetime.strptime(start_time_str, '%H:%M:%S')
-        end_time = datetime.datetime.strptime(end_time_str, '%H:%M:%S')
-    except ValueError:
-        print("错误: 时间格式不正确。请使用 HH/MM/SS 或 HH:MM:SS 格式。")
-        return
-
-    # 伪装请求头，这是绕过 403 错误的关键
-    headers = {
-        'Referer': 'https://www.pixiv.net/',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-
-    found_timestamps = []
-    current_time = start_time
-
-    print(f"开始扫描...\n从: {start_time.strftime('%H:%M:%S')}\n到:   {end_time.strftime('%H:%M:%S')}\n")
-
-    while current_time <= end_time:
-        # 将当前时间格式化为 URL 所需的 HH/MM/SS 格式
-        time_for_url = current_time.strftime('%H/%M/%S')
-        
-        # 构建完整的 URL
-        full_url = base_url_template.format(time=time_for_url) + image_id
-        
-        try:
-            # 发送 GET 请求
-            response = requests.get(full_url, headers=headers, timeout=10) # 设置10秒超时
-            
-            # 检查 HTTP 状态码
-            if response.status_code == 200:
-                timestamp_str = current_time.strftime('%H:%M:%S')
-                print(f"✅ 资源存在! 时间: {timestamp_str} -> {full_url}")
-                found_timestamps.append(timestamp_str)
-            else:
-                # 使用 print 的 end='\r' 来实现单行刷新，避免刷屏
-                print(f"❌ 未找到... 时间: {current_time.strftime('%H:%M:%S')} (状态码: {response.status_code})", end='\r')
-
-        except requests.exceptions.RequestException as e:
-            # 处理网络连接等异常
-            print(f" E 发生错误: {current_time.strftime('%H:%M:%S')} - {e}", end='\r')
-
-        # 时间增加一秒
-        current_time += datetime.timedelta(seconds=1)
-        
-        # 可以取消注释下一行来降低请求频率，避免对服务器造成过大压力
-        # time.sleep(0.1) 
-
-    print("\n\n扫描完成。")
-
-    if found_timestamps:
-        print("\n--- 存在的资源时间戳汇总 ---")
-        for ts in found_timestamps:
-            print(ts)
-    else:
-        print("\n在指定时间范围内没有找到任何存在的资源。")
-
-
-if __name__ == '__main__':
-    # --- 请在这里配置您的参数 ---
-
-    # 1. URL 模板 (从您给的 URL 中提取)
-    # 将时间部分替换为 {time}
-    BASE_URL_TEMPLATE = "https://i.pximg.net/img-original/img/YYYY/MM/DD/"
-    BASE_URL_TEMPLATE += "{time}/"
-    # 2. 图片文件名 (从您给的 URL 中提取)
-    ARTWORK_ID = 123456789
-    IMAGE_ID = f"{ARTWORK_ID}_p0.png"
-
-    # 3. 开始和结束时间
-    START_TIME = "HH/MM/SS"
-    END_TIME = "HH/MM/SS"
-
-    # --- 执行检查 ---
-    check_pixiv_image_existence(BASE_URL_TEMPLATE, START_TIME, END_TIME, IMAGE_ID)
\ No newline at end of file
+import datetime
+
+from probe_engine import ProbeEngine, DEFAULT_CONCURRENCY, PROBE_HEAD, OUTCOME_MISS
+from probe_cache import ProbeCache
+from scheduler import URL_TIME_FORMAT, window_size
+
+# 支持的时间格式：仅时间，或带日期的完整时间
+TIME_FORMATS = ('%H:%M:%S', '%H/%M/%S', '%Y/%m/%d/%H/%M/%S', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S')
+
+
+def parse_time(time_str):
+    """解析时间字符串，无法解析时返回 None。仅含时间时日期为 1900-01-01。"""
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(time_str.strip(), fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def check_pixiv_image_existence(base_url_template, start_time_str, end_time_str, image_id,
+                                concurrency=DEFAULT_CONCURRENCY, stop_on_first_hit=True,
+                                probe_method=PROBE_HEAD, cache=None):
+    """
+    在指定时间范围内逐秒并发检查 Pixiv 图片资源是否存在。
+
+    :param base_url_template: 包含 {time} 或 {datetime} 占位符的 URL 模板。
+                              {time} 只替换时间，日期写在模板中，例如:
+                              "https://i.pximg.net/img-original/img/2025/06/08/{time}/"
+                              {datetime} 同时替换日期和时间，可用于跨越午夜或多天的范围，例如:
+                              "https://i.pximg.net/img-original/img/{datetime}/"
+    :param start_time_str: 开始时间，格式为 "HH:MM:SS" 或 "HH/MM/SS"；
+                           使用 {datetime} 时为 "YYYY-MM-DD HH:MM:SS" 或 "YYYY/MM/DD/HH/MM/SS"。
+    :param end_time_str: 结束时间，格式同上。
+    :param image_id: 图片的文件名，例如: "123456789_p0.png"。
+    :param concurrency: 同时进行的请求数。
+    :param stop_on_first_hit: 找到第一个存在的资源后立即停止扫描。
+    :param probe_method: 探测方式: "head"、"range" (只请求 1 字节) 或 "get"，均不下载图片正文。
+    :param cache: 可选的 ProbeCache。已确定结果的 URL 不再请求，并保存扫描断点以便中断后继续。
+    :return: 存在资源的时间戳列表。
+    """
+
+    # 将时间字符串解析为 datetime 对象
+    start_time = parse_time(start_time_str)
+    end_time = parse_time(end_time_str)
+    if start_time is None or end_time is None:
+        print("错误: 时间格式不正确。请使用 HH/MM/SS、HH:MM:SS 或 YYYY-MM-DD HH:MM:SS 格式。")
+        return
+
+    with_date = '{datetime}' in base_url_template
+    if with_date and (start_time.year == 1900 or end_time.year == 1900):
+        print("错误: 使用 {datetime} 模板时，开始和结束时间都需要包含日期。")
+        return
+    if end_time < start_time:
+        print("错误: 结束时间早于开始时间。如果范围跨越午夜，请使用 {datetime} 模板和完整日期。")
+        return
+
+    display_format = '%Y-%m-%d %H:%M:%S' if with_date else '%H:%M:%S'
+    total = window_size(start_time, end_time)
+
+    def candidates():
+        # 按需逐个生成 URL，不预先构建列表，适用于很长的时间范围
+        for offset in range(total):
+            current_time = start_time + datetime.timedelta(seconds=offset)
+            if with_date:
+                full_url = base_url_template.format(datetime=current_time.strftime(URL_TIME_FORMAT)) + image_id
+            else:
+                # 将当前时间格式化为 URL 所需的 HH/MM/SS 格式
+                full_url = base_url_template.format(time=current_time.strftime('%H/%M/%S')) + image_id
+            yield full_url, current_time.strftime(display_format)
+
+    checkpoint_key = f"{base_url_template}|{start_time_str}|{end_time_str}|{image_id}"
+    # 从断点继续时，已检查的部分不会再报告
+    checked = cache.get_checkpoint(checkpoint_key) if cache is not None else 0
+
+    def report(result):
+        nonlocal checked
+        checked += 1
+        engine.metrics.set_progress(checked, total)
+        if result.found:
+            print(f"\n✅ 资源存在! 时间: {result.meta} -> {result.url} "
+                  f"({result.content_type}, {result.content_length} 字节)")
+        elif result.outcome != OUTCOME_MISS:
+            # 限流、403、5xx 或网络错误在重试后仍没有回答，单独占一行，不会被下一条状态覆盖
+            reason = result.error or f"状态码: {result.status}"
+            print(f"\n⚠️ 没有得到回答: {result.meta} - {reason} (共尝试 {result.attempts} 次)")
+        else:
+            # 使用 print 的 end='\r' 来实现单行刷新，避免刷屏
+            print(f"❌ 未找到... 时间: {result.meta} (状态码: {result.status}) | "
+                  f"{engine.metrics.status_line()}", end='\r')
+
+    print(f"开始扫描...\n从: {start_time.strftime(display_format)}\n到:   {end_time.strftime(display_format)}\n共 {total} 秒\n")
+
+    # 并发探测，找到资源后立即停止其余请求
+    engine = ProbeEngine(concurrency=concurrency, method=probe_method, cache=cache)
+    engine.metrics.begin_progress(checked, total)
+    hits = engine.run(candidates(), on_result=report, stop_on_hit=stop_on_first_hit,
+                      checkpoint_key=checkpoint_key)
+    found_timestamps = sorted(hit.meta for hit in hits)
+
+    print("\n\n扫描完成。")
+    summary = engine.summary()
+    print(f"请求统计: {engine.metrics.status_line()}")
+    print(f"  状态码: {summary['statuses']}")
+    if summary['exceptions']:
+        print(f"  异常: {summary['exceptions']}")
+    if summary['retries'] or summary['hedges']:
+        print(f"  重试: {summary['retries']} 次, 对冲请求: {summary['hedges']} 次")
+
+    # 限流或出错且重试用尽的候选没有得到回答，资源可能就在其中
+    unresolved = sorted(result.meta for result in engine.unresolved)
+    if unresolved:
+        print(f"\n⚠️ 以下 {len(unresolved)} 个时间点在 {engine.max_retries} 次重试后仍未得到回答，请稍后重新检查:")
+        for ts in unresolved:
+            print(ts)
+
+    if found_timestamps:
+        print("\n--- 存在的资源时间戳汇总 ---")
+        for ts in found_timestamps:
+            print(ts)
+    elif unresolved:
+        print("\n⚠️ 没有找到资源，但上述时间点没有得到回答，结果不确定，请稍后重新搜索。")
+    else:
+        print("\n在指定时间范围内没有找到任何存在的资源。")
+
+    return found_timestamps
+
+
+if __name__ == '__main__':
+    # --- 请在这里配置您的参数 ---
+
+    # 1. URL 模板 (从您给的 URL 中提取)
+    # 将时间部分替换为 {time}
+    BASE_URL_TEMPLATE = "https://i.pximg.net/img-original/img/YYYY/MM/DD/"
+    BASE_URL_TEMPLATE += "{time}/"
+    # 2. 图片文件名 (从您给的 URL 中提取)
+    ARTWORK_ID = 123456789
+    IMAGE_ID = f"{ARTWORK_ID}_p0.png"
+
+    # 3. 开始和结束时间
+    START_TIME = "HH/MM/SS"
+    END_TIME = "HH/MM/SS"
+
+    # --- 执行检查 ---
+    # 使用本地缓存，中断后重新运行会从断点继续
+    check_pixiv_image_existence(BASE_URL_TEMPLATE, START_TIME, END_TIME, IMAGE_ID, cache=ProbeCache())
\ No newline at end of file
@@ -0,0 +1,181 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_control import AdaptiveRateController, THROTTLE_STATUSES, parse_retry_after
+
+
+# Connections kept alive per host; should be at least the probe concurrency
+DEFAULT_POOL_SIZE = 16
+
+DEFAULT_TIMEOUT = 10
+DOWNLOAD_TIMEOUT = 20
+
+# Throttled (429/503) requests are retried this many times before the response is returned
+MAX_THROTTLE_RETRIES = 3
+# Base delay before retrying a throttled request that carried no Retry-After
+THROTTLE_BACKOFF = 0.5
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'
+
+# i.pximg.net 需要 Referer 才不会返回 403
+IMAGE_HEADERS = {
+    'Referer': 'https://www.pixiv.net/',
+    'User-Agent': USER_AGENT
+}
+
+PAGE_HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Upgrade-Insecure-Requests': '1'
+}
+
+# pixiv.net/ajax/* 接口
+JSON_HEADERS = {
+    'Referer': 'https://www.pixiv.net/',
+    'User-Agent': USER_AGENT,
+    'Accept': 'application/json',
+    'Accept-Language': 'en-US,en;q=0.5'
+}
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_pool_size = DEFAULT_POOL_SIZE
+_rate_controller: Optional[AdaptiveRateController] = AdaptiveRateController()
+# host -> base URL that requests for it are sent to instead (e.g. a local mock server)
+_host_overrides: Dict[str, str] = {}
+# Called after every request with (method, url, status, seconds until the headers arrived, exception)
+RequestObserver = Callable[[str, str, Optional[int], float, Optional[BaseException]], None]
+_observers: List[RequestObserver] = []
+
+
+def _build_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the shared keep-alive session used by every module."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = _build_session(_pool_size)
+        return _session
+
+
+def set_pool_size(pool_size: int):
+    """Resize the connection pool. Requests already in flight finish on the old pool."""
+    global _session, _pool_size
+    if pool_size < 1:
+        raise ValueError("pool_size must be at least 1")
+    with _lock:
+        if pool_size != _pool_size or _session is None:
+            _pool_size = pool_size
+            _session = _build_session(pool_size)
+
+
+def ensure_pool_size(pool_size: int):
+    """Grow the connection pool so it can serve pool_size concurrent requests."""
+    if pool_size > _pool_size:
+        set_pool_size(pool_size)
+
+
+def set_rate_controller(controller: Optional[AdaptiveRateController]):
+    """Pace every request sent through this module with controller; None removes all pacing."""
+    global _rate_controller
+    _rate_controller = controller
+
+
+def get_rate_controller() -> Optional[AdaptiveRateController]:
+    return _rate_controller
+
+
+def set_host_override(host: str, base_url: Optional[str]):
+    """
+    Send requests for host to base_url instead, keeping the path and query.
+    For example set_host_override('i.pximg.net', 'http://127.0.0.1:8080').
+    base_url None removes the override.
+    """
+    if base_url is None:
+        _host_overrides.pop(host, None)
+    else:
+        _host_overrides[host] = base_url.rstrip('/')
+
+
+def _resolve(url: str) -> str:
+    if not _host_overrides:
+        return url
+    parts = urlsplit(url)
+    base_url = _host_overrides.get(parts.hostname or '')
+    if base_url is None:
+        return url
+    return base_url + url[len(f"{parts.scheme}://{parts.netloc}"):]
+
+
+def add_request_observer(observer: RequestObserver):
+    """Call observer after every request sent through this module, from the sending thread."""
+    _observers.append(observer)
+
+
+def remove_request_observer(observer: RequestObserver):
+    if observer in _observers:
+        _observers.remove(observer)
+
+
+def request(method: str, url: str, headers: Optional[dict] = None, timeout: float = DEFAULT_TIMEOUT,
+            observer: Optional[RequestObserver] = None, **kwargs) -> requests.Response:
+    """
+    Send a request through the shared session and rate controller.
+
+    Throttled responses are fed back to the controller and retried after
+    Retry-After (or an exponential delay), up to MAX_THROTTLE_RETRIES times.
+    observer is called for this request (and each retry) in addition to the
+    global observers.
+    """
+    headers = headers if headers is not None else IMAGE_HEADERS
+    target = _resolve(url)
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        controller = _rate_controller
+        if controller is not None:
+            controller.acquire()
+        status = None
+        retry_after = None
+        error = None
+        started = time.perf_counter()
+        try:
+            response = get_session().request(method, target, headers=headers, timeout=timeout, **kwargs)
+            status = response.status_code
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if controller is not None:
+                controller.release(status, retry_after)
+            elapsed = time.perf_counter() - started
+            for notify in _observers + ([observer] if observer else []):
+                notify(method, url, status, elapsed, error)
+        if status not in THROTTLE_STATUSES or attempt == MAX_THROTTLE_RETRIES:
+            return response
+        response.close()
+        if retry_after is None or controller is None:
+            time.sleep(retry_after if retry_after is not None else THROTTLE_BACKOFF * 2 ** attempt)
+    return response
+
+
+def get(url: str, headers: Optional[dict] = None, timeout: float = DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    """GET through the shared session, with image headers by default."""
+    return request('GET', url, headers=headers, timeout=timeout, **kwargs)
+
+
+def head(url: str, headers: Optional[dict] = None, timeout: float = DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    """HEAD through the shared session, with image headers by default."""
+    return request('HEAD', url, headers=headers, timeout=timeout, **kwargs)
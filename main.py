@@ -1,17 +1,45 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
-import requests
 import datetime
 import time
 import os
+import queue
 import re
-from typing import Tuple, Optional
+from typing import Optional
 import threading
+import traceback
 
 # Import functions from existing modules
+import http_client
 from find_adj import find_adjacent_valid_artworks, build_pixiv_artwork_url
 from find_resource import check_pixiv_image_existence
 from resource_downloader import download_pixiv_gallery
+from probe_engine import ProbeEngine, DEFAULT_CONCURRENCY
+from probe_cache import ProbeCache
+from scheduler import (ORDER_INTERLEAVED, ORDER_WEIGHTED, ORDER_FORMAT_FIRST,
+                       TIME_LINEAR, TIME_SPIRAL, TIME_LEARNED)
+from search import search_artwork, search_cluster
+from page_parser import fetch_artwork_info
+from metrics import write_summary
+from time_index import TimeIndex, INDEX_WINDOW_LIMIT
+
+# Candidate order choices shown in the GUI
+ORDER_LABELS = {
+    "All formats per second": ORDER_INTERLEAVED,
+    "Weighted by past hits": ORDER_WEIGHTED,
+    "One format at a time": ORDER_FORMAT_FIRST,
+}
+
+TIME_ORDER_LABELS = {
+    "Outward from estimate": TIME_SPIRAL,
+    "Learned from past hits": TIME_LEARNED,
+    "From previous artwork": TIME_LINEAR,
+}
+
+# How often the Tk loop applies queued worker updates (about 20 frames per second)
+UI_REFRESH_MS = 50
+# Log lines inserted per frame at most, so a burst of messages cannot stall the window
+MAX_LOG_LINES_PER_FRAME = 500
 
 
 class PixivResourceFinder:
@@ -29,8 +57,27 @@ class PixivResourceFinder:
         self.file_jpg = tk.BooleanVar(value=True)
         self.file_png = tk.BooleanVar(value=True)
         self.file_gif = tk.BooleanVar(value=False)
+        self.concurrency = tk.IntVar(value=DEFAULT_CONCURRENCY)
+        self.candidate_order = tk.StringVar(value="All formats per second")
+        self.time_order = tk.StringVar(value="Outward from estimate")
+        self.two_phase = tk.BooleanVar(value=False)
+        
+        # Probe results and search checkpoints persist across sessions
+        self.cache = ProbeCache()
+        # Known upload times, used to fill neighbor URIs without any request
+        self.index = TimeIndex()
+        
+        # Worker threads never touch Tk widgets: log lines and UI calls go through
+        # this queue and only the latest progress is kept, both applied once per frame
+        self.ui_events = queue.Queue()
+        self.progress_lock = threading.Lock()
+        self.pending_progress = None
+        self.cancel_event = threading.Event()
+        self.active_engine = None
+        self.busy = False
         
         self.setup_gui()
+        self.root.after(UI_REFRESH_MS, self.drain_ui_events)
         
     def setup_gui(self):
         # Main frame
@@ -40,12 +87,14 @@ class PixivResourceFinder:
         # Step 1: Input artwork ID
         ttk.Label(main_frame, text="Step 1: Input Pixiv Artwork ID", font=("Arial", 12, "bold")).grid(row=0, column=0, columnspan=2, sticky=tk.W, pady=(0, 5))
         
-        ttk.Label(main_frame, text="Artwork ID:").grid(row=1, column=0, sticky=tk.W, pady=2)
-        self.artwork_id_entry = ttk.Entry(main_frame, textvariable=self.artwork_id, width=20)
+        # Several IDs between the same two neighbors (comma separated) are searched together
+        ttk.Label(main_frame, text="Artwork ID(s):").grid(row=1, column=0, sticky=tk.W, pady=2)
+        self.artwork_id_entry = ttk.Entry(main_frame, textvariable=self.artwork_id, width=30)
         self.artwork_id_entry.grid(row=1, column=1, sticky=tk.W, pady=2)
         self.artwork_id_entry.bind("<Return>", lambda e: self.find_adjacent_artworks())
         
-        ttk.Button(main_frame, text="Find Adjacent Artworks", command=self.find_adjacent_artworks).grid(row=1, column=2, padx=(10, 0), pady=2)
+        self.find_button = ttk.Button(main_frame, text="Find Adjacent Artworks", command=self.find_adjacent_artworks)
+        self.find_button.grid(row=1, column=2, padx=(10, 0), pady=2)
         
         # Step 2: Show adjacent artworks
         ttk.Label(main_frame, text="Step 2: Adjacent Artworks", font=("Arial", 12, "bold")).grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=(20, 5))
@@ -58,10 +107,10 @@ class PixivResourceFinder:
         self.next_url_entry = ttk.Entry(main_frame, textvariable=self.next_artwork_url, width=60)
         self.next_url_entry.grid(row=4, column=1, columnspan=2, sticky=(tk.W, tk.E), pady=2)
         
-        # Step 3: Manual URI input
-        ttk.Label(main_frame, text="Step 3: Manual Image URI Input", font=("Arial", 12, "bold")).grid(row=5, column=0, columnspan=2, sticky=tk.W, pady=(20, 5))
+        # Step 3: Neighbor URIs, filled automatically by Step 1 when possible
+        ttk.Label(main_frame, text="Step 3: Image URI Input", font=("Arial", 12, "bold")).grid(row=5, column=0, columnspan=2, sticky=tk.W, pady=(20, 5))
         
-        instruction_text = """Please manually visit the artwork pages above and find the first image's img-original link:
+        instruction_text = """These fields are filled automatically after Step 1. If one stays empty, visit the artwork page above and find the first image's img-original link:
 1. Open the artwork page in your browser
 2. Right-click on the first image and select "Inspect Element"
 3. Find the href attribute containing img-original link
@@ -85,8 +134,27 @@ class PixivResourceFinder:
         ttk.Checkbutton(file_frame, text="PNG", variable=self.file_png).grid(row=0, column=1, padx=(0, 10))
         ttk.Checkbutton(file_frame, text="GIF", variable=self.file_gif).grid(row=0, column=2, padx=(0, 10))
         
+        ttk.Label(file_frame, text="Concurrent requests:").grid(row=0, column=3, padx=(20, 5))
+        ttk.Spinbox(file_frame, from_=1, to=128, textvariable=self.concurrency, width=5).grid(row=0, column=4)
+        
+        ttk.Label(file_frame, text="Order:").grid(row=0, column=5, padx=(20, 5))
+        ttk.Combobox(file_frame, textvariable=self.candidate_order, values=list(ORDER_LABELS),
+                     state="readonly", width=22).grid(row=0, column=6)
+        
+        ttk.Checkbutton(file_frame, text="Two-phase (locate via preview, then check formats)",
+                        variable=self.two_phase).grid(row=1, column=0, columnspan=5, sticky=tk.W, pady=(5, 0))
+        
+        ttk.Label(file_frame, text="Time order:").grid(row=1, column=5, padx=(20, 5), pady=(5, 0))
+        ttk.Combobox(file_frame, textvariable=self.time_order, values=list(TIME_ORDER_LABELS),
+                     state="readonly", width=22).grid(row=1, column=6, pady=(5, 0))
+        
         # Step 5: Search button
-        ttk.Button(main_frame, text="Start Resource Search", command=self.start_search).grid(row=11, column=0, columnspan=3, pady=20)
+        button_frame = ttk.Frame(main_frame)
+        button_frame.grid(row=11, column=0, columnspan=3, pady=20)
+        self.search_button = ttk.Button(button_frame, text="Start Resource Search", command=self.start_search)
+        self.search_button.grid(row=0, column=0, padx=5)
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", command=self.cancel, state=tk.DISABLED)
+        self.cancel_button.grid(row=0, column=1, padx=5)
         
         # Progress bar
         ttk.Label(main_frame, text="Search Progress:", font=("Arial", 10)).grid(row=12, column=0, sticky=tk.W, pady=(10, 5))
@@ -110,12 +178,30 @@ class PixivResourceFinder:
         self.root.rowconfigure(0, weight=1)
     
     def log(self, message: str):
-        """Add message to log area"""
-        self.log_text.insert(tk.END, f"{datetime.datetime.now().strftime('%H:%M:%S')} - {message}\n")
-        self.log_text.see(tk.END)
-        self.root.update_idletasks()
+        """Queue a line for the log area; safe to call from any thread"""
+        self.ui_events.put(f"{datetime.datetime.now().strftime('%H:%M:%S')} - {message}\n")
+    
+    def call_in_ui(self, callback, *args):
+        """Run callback on the Tk thread at the next frame; safe to call from any thread"""
+        self.ui_events.put((callback, args))
     
     def update_progress(self, current: int, total: int, message: str = ""):
+        """Set the progress shown at the next frame; only the latest value is drawn"""
+        with self.progress_lock:
+            self.pending_progress = (current, total, message)
+    
+    def update_search_progress(self, current: int, total: int, message: str = ""):
+        """Update progress with the current request rate from the shared rate controller"""
+        controller = http_client.get_rate_controller()
+        if controller is not None:
+            message = f"{message} @ {controller.current_rate:.0f} req/s"
+        self.update_progress(current, total, message)
+    
+    def reset_progress(self, message: str = "Ready"):
+        """Reset progress bar"""
+        self.update_progress(0, 0, message)
+    
+    def draw_progress(self, current: int, total: int, message: str):
         """Update progress bar and label"""
         if total > 0:
             progress_value = (current / total) * 100
@@ -128,65 +214,151 @@ class PixivResourceFinder:
         else:
             self.progress['value'] = 0
             self.progress_label.config(text=message if message else "Ready")
-        
-        self.root.update_idletasks()
     
-    def reset_progress(self, message: str = "Ready"):
-        """Reset progress bar"""
-        self.progress['value'] = 0
-        self.progress_label.config(text=message)
-        self.root.update_idletasks()
+    def drain_ui_events(self):
+        """Apply queued worker updates on the Tk thread, once per frame"""
+        with self.progress_lock:
+            progress, self.pending_progress = self.pending_progress, None
+        if progress is not None:
+            self.draw_progress(*progress)
+        
+        # Consecutive log lines are inserted with a single call
+        lines = []
+        try:
+            while len(lines) < MAX_LOG_LINES_PER_FRAME:
+                event = self.ui_events.get_nowait()
+                if isinstance(event, str):
+                    lines.append(event)
+                    continue
+                self.append_log(lines)
+                lines = []
+                callback, args = event
+                callback(*args)
+        except queue.Empty:
+            pass
+        self.append_log(lines)
+        
+        self.root.after(UI_REFRESH_MS, self.drain_ui_events)
     
-
+    def append_log(self, lines):
+        if lines:
+            self.log_text.insert(tk.END, "".join(lines))
+            self.log_text.see(tk.END)
     
-
+    def set_busy(self, busy: bool):
+        """Allow only one network task at a time; Cancel is enabled while one runs"""
+        self.busy = busy
+        state = tk.DISABLED if busy else tk.NORMAL
+        self.find_button.config(state=state)
+        self.search_button.config(state=state)
+        self.cancel_button.config(state=tk.NORMAL if busy else tk.DISABLED)
+    
+    def start_task(self, target, *args):
+        """Run a network task on a background thread"""
+        self.cancel_event.clear()
+        self.set_busy(True)
+        
+        def run():
+            try:
+                target(*args)
+            finally:
+                self.active_engine = None
+                self.call_in_ui(self.set_busy, False)
+        
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+    
+    def cancel(self):
+        """Stop the running task; probes in flight are abandoned right away"""
+        if not self.busy or self.cancel_event.is_set():
+            return
+        self.cancel_event.set()
+        engine = self.active_engine
+        if engine is not None:
+            engine.stop()
+        self.log("Cancelling...")
+    
+    def parse_artwork_ids(self):
+        """Read the artwork IDs entered in Step 1; None if any is not a number"""
+        fields = [field for field in re.split(r'[,\s]+', self.artwork_id.get()) if field]
+        if not fields or not all(field.isdigit() for field in fields):
+            return None
+        return list(dict.fromkeys(int(field) for field in fields))
     
     def find_adjacent_artworks(self):
         """Find adjacent artwork IDs"""
-        try:
-            center_id = int(self.artwork_id.get())
-        except ValueError:
+        if self.busy:
+            return
+        target_ids = self.parse_artwork_ids()
+        if not target_ids:
             messagebox.showerror("Error", "Please enter a valid artwork ID")
             return
+        center_id = target_ids[0]
         
+        self.start_task(self.adjacent_worker, center_id)
+    
+    def adjacent_worker(self, center_id: int):
+        """Worker thread for finding adjacent artworks and their image URIs"""
         self.log(f"Starting to find adjacent artworks for artwork {center_id}...")
+        self.update_progress(0, 0, "Finding adjacent artworks...")
+        
+        known = self.index.bracket_uris(center_id, max_window=INDEX_WINDOW_LIMIT)
+        if known:
+            # Earlier searches already bracket this artwork closely enough
+            self.call_in_ui(self.prev_uri.set, known[0])
+            self.call_in_ui(self.next_uri.set, known[1])
+            self.log(f"Neighbor URIs filled from the time index ({len(self.index)} known artworks):")
+            self.log(f"Previous artwork URI: {known[0]}")
+            self.log(f"Next artwork URI: {known[1]}")
+            self.reset_progress("Ready")
+            return
         
         # Use existing function from find_adj.py
-        prev_id, next_id = find_adjacent_valid_artworks(center_id)
+        try:
+            prev_id, next_id = find_adjacent_valid_artworks(center_id, cache=self.cache, stop=self.cancel_event,
+                                                            on_page=self.index.add_page)
+        except Exception as e:
+            self.log(f"❌ Error occurred while finding adjacent artworks: {e}")
+            self.reset_progress("Failed to find adjacent artworks")
+            return
+        if self.cancel_event.is_set():
+            self.log("Finding adjacent artworks cancelled")
+            self.reset_progress("Cancelled")
+            return
         
         # Update GUI
-        self.prev_artwork_url.set(build_pixiv_artwork_url(prev_id))
-        self.next_artwork_url.set(build_pixiv_artwork_url(next_id))
-        
-        self.log(f"Previous artwork URL: {build_pixiv_artwork_url(prev_id)}")
-        self.log(f"Next artwork URL: {build_pixiv_artwork_url(next_id)}")
-        self.log("Please manually visit the URLs above to get the first image's img-original link")
-    
-    def extract_time_range(self, prev_uri: str, next_uri: str, target_id: int) -> Tuple[str, str, str]:
-        """Extract time range from URIs"""
-        # Extract time from URI pattern: img/2025/05/12/22/30/17/
-        pattern = r'img/(\d{4})/(\d{2})/(\d{2})/(\d{2})/(\d{2})/(\d{2})/'
-        
-        prev_match = re.search(pattern, prev_uri)
-        next_match = re.search(pattern, next_uri)
-        
-        if not prev_match or not next_match:
-            raise ValueError("Unable to extract time information from URI")
-        
-        prev_time = f"{prev_match.group(4)}:{prev_match.group(5)}:{prev_match.group(6)}"
-        next_time = f"{next_match.group(4)}:{next_match.group(5)}:{next_match.group(6)}"
-        
-        # Extract base URL template using the target artwork ID
-        # Use the date structure from one of the URIs but with target artwork ID
-        # Format: https://i.pximg.net/img-original/img/YYYY/MM/DD/{time}/ARTWORK_ID_p0
-        base_url = f"https://i.pximg.net/img-original/img/{prev_match.group(1)}/{prev_match.group(2)}/{prev_match.group(3)}/{{time}}/{target_id}_p0"
-        
-        return prev_time, next_time, base_url
-    
-
+        if prev_id is None or next_id is None:
+            self.log("❌ No valid adjacent artwork found within the search limits")
+        if prev_id is not None:
+            self.call_in_ui(self.prev_artwork_url.set, build_pixiv_artwork_url(prev_id))
+            self.log(f"Previous artwork URL: {build_pixiv_artwork_url(prev_id)}")
+        if next_id is not None:
+            self.call_in_ui(self.next_artwork_url.set, build_pixiv_artwork_url(next_id))
+            self.log(f"Next artwork URL: {build_pixiv_artwork_url(next_id)}")
+        
+        # Read the neighbors' image URIs from their artwork data
+        for artwork_id, uri_var, label in ((prev_id, self.prev_uri, "Previous"), (next_id, self.next_uri, "Next")):
+            if artwork_id is None or self.cancel_event.is_set():
+                continue
+            try:
+                info = fetch_artwork_info(artwork_id)
+            except Exception as e:
+                self.log(f"❌ Failed to read artwork {artwork_id}: {e}")
+                info = None
+            if info:
+                self.index.add(artwork_id, info.upload_time)
+                self.call_in_ui(uri_var.set, info.uri)
+                self.log(f"{label} artwork URI: {info.uri}")
+            else:
+                self.log(f"Please manually visit {build_pixiv_artwork_url(artwork_id)} to get the first image's img-original link")
+        self.index.save()
+        self.reset_progress("Cancelled" if self.cancel_event.is_set() else "Ready")
     
     def start_search(self):
         """Start searching for resources"""
+        if self.busy:
+            return
         if not self.prev_uri.get() or not self.next_uri.get():
             messagebox.showerror("Error", "Please enter both previous and next artwork URIs")
             return
@@ -195,99 +367,84 @@ class PixivResourceFinder:
             messagebox.showerror("Error", "Please select at least one file type")
             return
         
-        # Extract target artwork ID
-        try:
-            target_id = int(self.artwork_id.get())
-        except ValueError:
+        # Extract target artwork IDs
+        target_ids = self.parse_artwork_ids()
+        if not target_ids:
             messagebox.showerror("Error", "Invalid artwork ID")
             return
         
+        # Tk variables are only read here, on the Tk thread
+        extensions = []
+        if self.file_jpg.get():
+            extensions.append('jpg')
+        if self.file_png.get():
+            extensions.append('png')
+        if self.file_gif.get():
+            extensions.append('gif')
+        settings = {
+            'prev_uri': self.prev_uri.get(),
+            'next_uri': self.next_uri.get(),
+            'extensions': extensions,
+            'concurrency': max(1, self.concurrency.get()),
+            'order_label': self.candidate_order.get(),
+            'time_order_label': self.time_order.get(),
+            'two_phase': self.two_phase.get(),
+        }
+        self.index.add_uri(settings['prev_uri'])
+        self.index.add_uri(settings['next_uri'])
+        self.index.save()
+        
         # Start search in background thread
-        thread = threading.Thread(target=self.search_worker, args=(target_id,))
-        thread.daemon = True
-        thread.start()
+        if len(target_ids) > 1:
+            self.start_task(self.cluster_search_worker, target_ids, settings)
+        else:
+            self.start_task(self.search_worker, target_ids[0], settings)
     
-    def search_worker(self, target_id: int):
+    def search_worker(self, target_id: int, settings: dict):
         """Worker thread for searching resources"""
         try:
             # Reset progress bar
             self.reset_progress("Initializing search...")
             
-            # Extract time range
-            prev_uri = self.prev_uri.get()
-            next_uri = self.next_uri.get()
-            
-            prev_time, next_time, base_url = self.extract_time_range(prev_uri, next_uri, target_id)
-            
-            self.log(f"Time range: {prev_time} to {next_time}")
-            self.log(f"Base URL template: {base_url}")
+            self.log(f"Candidate order: {settings['order_label']}")
+            self.update_progress(0, 0, "Starting search...")
             
-            # Prepare extensions
-            extensions = []
-            if self.file_jpg.get():
-                extensions.append('jpg')
-            if self.file_png.get():
-                extensions.append('png')
-            if self.file_gif.get():
-                extensions.append('gif')
+            def on_progress(current: int, total: int, message: str):
+                # Also catches a Cancel pressed before the sweep started
+                if self.cancel_event.is_set():
+                    engine.stop()
+                eta = engine.metrics.eta()
+                if eta is not None:
+                    message = f"{message}, ETA {eta:.0f}s"
+                self.update_search_progress(current, total, message)
             
-            self.log(f"Searching file types: {', '.join(extensions)}")
-            
-            # Calculate total possible checks
-            start_time = datetime.datetime.strptime(prev_time, '%H:%M:%S')
-            end_time = datetime.datetime.strptime(next_time, '%H:%M:%S')
-            time_range_seconds = int((end_time - start_time).total_seconds()) + 1
-            total_checks = len(extensions) * time_range_seconds
-            current_check = 0
-            
-            self.log(f"Total time range: {time_range_seconds} seconds")
-            self.log(f"Maximum possible checks: {total_checks}")
-            self.update_progress(0, total_checks, "Starting search...")
-            
-            # First, check which resource type exists
-            found_extension = None
-            found_resource_url = None
-            
-            for ext_index, ext in enumerate(extensions):
-                image_id = f"{target_id}_p0.{ext}"
-                self.log(f"Checking {ext.upper()} format resource existence...")
-                
-                # Use find_resource.py function to check existence
-                # We need to manually check for existence first
-                headers = {
-                    'Referer': 'https://www.pixiv.net/',
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                }
-                
-                # Try a few time points to find the resource
-                current_time = datetime.datetime.strptime(prev_time, '%H:%M:%S')
-                end_time = datetime.datetime.strptime(next_time, '%H:%M:%S')
-                
-                while current_time <= end_time:
-                    current_check += 1
-                    time_for_url = current_time.strftime('%H/%M/%S')
-                    test_url = f"{base_url.replace('{time}', time_for_url)}.{ext}"
-                    
-                    # Update progress
-                    self.update_progress(current_check, total_checks, f"Checking {ext.upper()} at {time_for_url}")
-                    
-                    try:
-                        response = requests.get(test_url, headers=headers, timeout=10)
-                        if response.status_code == 200:
-                            found_extension = ext
-                            found_resource_url = test_url
-                            self.log(f"✅ Found {ext.upper()} format resource: {test_url}")
-                            self.update_progress(current_check, total_checks, f"Found {ext.upper()} resource!")
-                            break
-                    except Exception:
-                        pass
-                    
-                    current_time += datetime.timedelta(seconds=1)
-                
-                if found_extension:
-                    break
-                else:
-                    self.log(f"❌ {ext.upper()} format resource not found")
+            # Probe (time, format) pairs concurrently in the selected order, stopping on the first hit
+            engine = ProbeEngine(concurrency=settings['concurrency'], cache=self.cache)
+            self.active_engine = engine
+            if self.cancel_event.is_set():
+                # Cancel pressed before the engine existed
+                engine.stop()
+            result = search_artwork(target_id, settings['prev_uri'], settings['next_uri'], settings['extensions'],
+                                    engine=engine,
+                                    order=ORDER_LABELS[settings['order_label']],
+                                    time_order=TIME_ORDER_LABELS[settings['time_order_label']],
+                                    log=self.log, on_progress=on_progress,
+                                    two_phase=settings['two_phase'])
+            found_extension = result.extension
+            found_resource_url = result.url
+            total_checks = result.total
+            metrics_name = f"{target_id}-{datetime.datetime.now():%Y%m%d-%H%M%S}"
+            self.log(f"Search metrics saved to {write_summary(result.metrics, metrics_name)}")
+            if result.timestamp is not None:
+                # Also known when a two-phase search found the preview but no original
+                self.index.add(target_id, result.timestamp)
+                self.index.save()
+            if result.found:
+                self.update_progress(result.checked, total_checks, f"Found {found_extension.upper()} resource!")
+            elif self.cancel_event.is_set():
+                self.log("Search cancelled; it resumes from the checkpoint next time")
+                self.reset_progress("Search cancelled")
+                return
             
             # If we found a resource, download it using resource_downloader
             if found_extension and found_resource_url:
@@ -298,21 +455,98 @@ class PixivResourceFinder:
                 os.makedirs(download_dir, exist_ok=True)
                 
                 # Use resource_downloader function to download the gallery
-                download_pixiv_gallery(found_resource_url, download_dir)
+                pages = download_pixiv_gallery(found_resource_url, download_dir)
+                downloaded = sum(page.size for page in pages)
+                engine.metrics.add_bytes(downloaded)
+                # result.metrics covers both runs of a two-phase search; the engine's own summary only the last
+                result.metrics['bytes_downloaded'] += downloaded
+                write_summary(result.metrics, metrics_name)
+                for page in pages:
+                    if not page.ok:
+                        self.log(f"❌ Page {page.page} failed: {page.error or f'HTTP {page.status}'}")
                 
-                self.log(f"✅ Successfully downloaded {found_extension.upper()} format resource")
+                self.log(f"✅ Successfully downloaded {found_extension.upper()} format resource "
+                         f"({sum(1 for page in pages if page.ok)}/{len(pages)} pages)")
                 self.reset_progress("Download completed successfully!")
-                messagebox.showinfo("Success", f"Found and successfully downloaded {found_extension.upper()} format resource to download/ directory")
+                self.call_in_ui(messagebox.showinfo, "Success", f"Found and successfully downloaded {found_extension.upper()} format resource to download/ directory")
+            elif result.unresolved:
+                self.log(f"⚠️ Not found, but {len(result.unresolved)} candidates got no answer; "
+                         f"search again later to check them")
+                self.reset_progress("Search completed - Inconclusive")
+                self.call_in_ui(messagebox.showwarning, "Inconclusive",
+                                f"No resource found, but {len(result.unresolved)} candidates could not be checked "
+                                f"(throttled or failing). The artwork may still exist; search again later.")
             else:
                 self.log("❌ No resources found in the specified time range with selected formats")
                 self.reset_progress("Search completed - No resources found")
-                messagebox.showwarning("Not Found", "No resources found in the specified time range with selected formats")
+                self.call_in_ui(messagebox.showwarning, "Not Found", "No resources found in the specified time range with selected formats")
                 
         except Exception as e:
-            self.log(f"❌ Error occurred during search: {e}")
+            traceback.print_exc()
+            self.log(f"❌ Error occurred during search: {type(e).__name__}: {e}")
             self.reset_progress("Search failed due to error")
-            messagebox.showerror("Error", f"Error occurred during search: {e}")
+            self.call_in_ui(messagebox.showerror, "Error", f"Error occurred during search: {e}")
     
+    def cluster_search_worker(self, target_ids, settings: dict):
+        """Worker thread sweeping one window for several artworks between the same neighbors"""
+        try:
+            self.reset_progress("Initializing search...")
+            self.log(f"Searching {len(target_ids)} artworks together: {', '.join(map(str, target_ids))}")
+            if settings['two_phase']:
+                self.log("Two-phase search applies to single artworks; sweeping every format")
+            
+            def on_progress(current: int, total: int, message: str):
+                if self.cancel_event.is_set():
+                    engine.stop()
+                eta = engine.metrics.eta()
+                if eta is not None:
+                    message = f"{message}, ETA {eta:.0f}s"
+                self.update_search_progress(current, total, message)
+            
+            engine = ProbeEngine(concurrency=settings['concurrency'], cache=self.cache)
+            self.active_engine = engine
+            if self.cancel_event.is_set():
+                # Cancel pressed before the engine existed
+                engine.stop()
+            results = search_cluster(target_ids, settings['prev_uri'], settings['next_uri'], settings['extensions'],
+                                     engine=engine,
+                                     order=ORDER_LABELS[settings['order_label']],
+                                     time_order=TIME_ORDER_LABELS[settings['time_order_label']],
+                                     log=self.log, on_progress=on_progress)
+            metrics_name = f"{min(target_ids)}-cluster-{datetime.datetime.now():%Y%m%d-%H%M%S}"
+            found = [result for result in results.values() if result.found]
+            for result in found:
+                self.index.add(result.target_id, result.timestamp)
+            self.index.save()
+            if self.cancel_event.is_set():
+                self.log("Search cancelled")
+            
+            # Every target's result shares the summary of the one sweep
+            summary = next(iter(results.values())).metrics
+            download_dir = "download"
+            os.makedirs(download_dir, exist_ok=True)
+            for index, result in enumerate(found, 1):
+                self.update_progress(index - 1, len(found), f"Downloading {result.target_id}...")
+                pages = download_pixiv_gallery(result.url, download_dir)
+                downloaded = sum(page.size for page in pages)
+                engine.metrics.add_bytes(downloaded)
+                summary['bytes_downloaded'] += downloaded
+                self.log(f"✅ {result.target_id}: downloaded {sum(1 for page in pages if page.ok)}/{len(pages)} pages")
+            for target_id, result in results.items():
+                if result.unresolved and not result.found:
+                    self.log(f"⚠️ {target_id}: not found, inconclusive ({len(result.unresolved)} candidates got no answer)")
+                elif not result.found:
+                    self.log(f"❌ {target_id}: not found")
+            
+            self.log(f"Search metrics saved to {write_summary(summary, metrics_name)}")
+            message = f"Found {len(found)} of {len(target_ids)} artworks"
+            self.reset_progress(message)
+            self.call_in_ui(messagebox.showinfo, "Search Finished", message + (" (downloaded to download/ directory)" if found else ""))
+        except Exception as e:
+            traceback.print_exc()
+            self.log(f"❌ Error occurred during search: {type(e).__name__}: {e}")
+            self.reset_progress("Search failed due to error")
+            self.call_in_ui(messagebox.showerror, "Error", f"Error occurred during search: {e}")
 
 
 
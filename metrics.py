@@ -0,0 +1,210 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Sequence
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Directory the GUI writes per-search JSON summaries to
+METRICS_DIR = 'metrics'
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, as in the Prometheus exposition format."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)   # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile by interpolating inside its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    Thread-safe counters for one search or one whole run.
+
+    An instance is a request observer (see http_client.add_request_observer):
+    it records each request's latency, status code or exception type. The
+    caller adds downloaded bytes and reports sweep progress, from which the
+    probe rate and the ETA for the rest of the window are derived.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self._started = time.monotonic()
+        self.latency = Histogram()
+        self.statuses: Counter = Counter()
+        self.exceptions: Counter = Counter()
+        self.bytes_downloaded = 0
+        self.checked = 0
+        self.total = 0
+        self._resumed_at = 0   # candidates already checked before this run, e.g. from a checkpoint
+
+    def __call__(self, method: str, url: str, status: Optional[int], elapsed: float,
+                 error: Optional[BaseException]):
+        with self._lock:
+            self.latency.observe(elapsed)
+            if status is not None:
+                self.statuses[status] += 1
+            else:
+                self.exceptions[type(error).__name__ if error is not None else 'Unknown'] += 1
+
+    def add_bytes(self, size: int):
+        with self._lock:
+            self.bytes_downloaded += size
+
+    def begin_progress(self, checked: int, total: int):
+        """Start the ETA from checked candidates, which do not count toward the rate."""
+        with self._lock:
+            self.checked, self.total, self._resumed_at = checked, total, checked
+
+    def set_progress(self, checked: int, total: int):
+        with self._lock:
+            self.checked, self.total = checked, total
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+    @property
+    def requests(self) -> int:
+        return self.latency.count
+
+    def latency_quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            return self.latency.quantile(q)
+
+    def probes_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.requests / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> Optional[float]:
+        """Seconds until the whole window is checked at the rate so far, None when unknown."""
+        with self._lock:
+            checked, total = self.checked, self.total
+            done = checked - self._resumed_at
+        elapsed = self.elapsed
+        if done <= 0 or not total or elapsed <= 0:
+            return None
+        return max(0, total - checked) * elapsed / done
+
+    def summary(self) -> dict:
+        """Everything recorded so far as a JSON-serializable dict."""
+        eta = self.eta()
+        with self._lock:
+            quantiles = {f"p{int(q * 100)}": self.latency.quantile(q) for q in (0.5, 0.9, 0.99)}
+            return {
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'elapsed': round(self.elapsed, 3),
+                'requests': self.latency.count,
+                'probes_per_sec': round(self.latency.count / self.elapsed, 2) if self.elapsed > 0 else 0.0,
+                'checked': self.checked,
+                'total': self.total,
+                'eta': round(eta, 1) if eta is not None else None,
+                'bytes_downloaded': self.bytes_downloaded,
+                'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+                'exceptions': dict(sorted(self.exceptions.items())),
+                'latency_ms': {name: round(value * 1000, 2) if value is not None else None
+                               for name, value in quantiles.items()},
+                'latency_histogram': {
+                    'buckets': list(self.latency.buckets),
+                    'counts': list(self.latency.counts),
+                    'sum': round(self.latency.sum, 6),
+                },
+            }
+
+    def status_line(self) -> str:
+        """One-line human summary for logs."""
+        eta = self.eta()
+        with self._lock:
+            p50 = self.latency.quantile(0.5)
+            errors = sum(self.exceptions.values())
+        return (f"{self.requests} requests, {self.probes_per_second():.0f}/s"
+                + (f", p50 {p50 * 1000:.0f}ms" if p50 is not None else "")
+                + (f", {errors} errors" if errors else "")
+                + (f", ETA {eta:.0f}s" if eta is not None else ""))
+
+    def to_prometheus(self, prefix: str = 'pixiv_finder', extra: Optional[Dict[str, float]] = None) -> str:
+        """Render the counters in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [f"# TYPE {prefix}_requests_total counter"]
+            for status, count in sorted(self.statuses.items()):
+                lines.append(f'{prefix}_requests_total{{status="{status}"}} {count}')
+            lines.append(f"# TYPE {prefix}_request_errors_total counter")
+            for name, count in sorted(self.exceptions.items()):
+                lines.append(f'{prefix}_request_errors_total{{exception="{name}"}} {count}')
+            lines.append(f"# TYPE {prefix}_request_latency_seconds histogram")
+            cumulative = 0
+            for bound, count in zip(self.latency.buckets + (float('inf'),), self.latency.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{prefix}_request_latency_seconds_bucket{{le="{le}"}} {cumulative}')
+            lines.append(f"{prefix}_request_latency_seconds_sum {self.latency.sum:.6f}")
+            lines.append(f"{prefix}_request_latency_seconds_count {self.latency.count}")
+            lines.append(f"# TYPE {prefix}_downloaded_bytes_total counter")
+            lines.append(f"{prefix}_downloaded_bytes_total {self.bytes_downloaded}")
+        gauges = {'probes_per_second': self.probes_per_second(), 'uptime_seconds': self.elapsed}
+        gauges.update(extra or {})
+        for name, value in gauges.items():
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+
+def write_summary(summary: dict, name: str, directory: str = METRICS_DIR) -> str:
+    """Save a summary as <directory>/<name>.json and return the path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return path
+
+
+def serve_prometheus(render: Callable[[], str], port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve render() as text at http://host:port/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
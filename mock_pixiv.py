@@ -0,0 +1,316 @@
+import datetime
+import html
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional
+
+import http_client
+from rate_control import TokenBucket
+from scheduler import URL_TIME_FORMAT
+
+# Hosts the mock answers for once installed
+IMAGE_HOST = 'i.pximg.net'
+PAGE_HOST = 'www.pixiv.net'
+
+# /img-original/img/2025/07/12/12/00/00/123456789_p0.png
+_ORIGINAL_PATH = re.compile(r'^(?:/c/[^/]+)?/img-original/img/(\d{4}/\d{2}/\d{2}/\d{2}/\d{2}/\d{2})/(\d+)_p(\d+)\.(\w+)$')
+# /img-master/img/2025/07/12/12/00/00/123456789_p0_master1200.jpg (also the /c/<size>/ thumbnails)
+_MASTER_PATH = re.compile(r'^(?:/c/[^/]+)?/img-master/img/(\d{4}/\d{2}/\d{2}/\d{2}/\d{2}/\d{2})/(\d+)_p(\d+)_(?:master|square)1200\.jpg$')
+_PAGE_PATH = re.compile(r'^(?:/en)?/artworks/(\d+)$')
+_AJAX_PATH = re.compile(r'^/ajax/illust/(\d+)$')
+
+NOT_FOUND_PAGE = b'<!DOCTYPE html><html><head><title>pixiv</title></head><body><h1>Page not found</h1></body></html>'
+
+
+@dataclass
+class MockArtwork:
+    """One artwork as the mock CDN and site see it."""
+    artwork_id: int
+    upload_time: datetime.datetime
+    extension: str = 'jpg'
+    pages: int = 1
+    visible: bool = True      # False: the page is deleted but the images are still on the CDN
+    page_size: int = 65536    # bytes of each original image
+
+    def image_path(self, page: int = 0) -> str:
+        return f"/img-original/img/{self.upload_time.strftime(URL_TIME_FORMAT)}/{self.artwork_id}_p{page}.{self.extension}"
+
+    def master_path(self, page: int = 0) -> str:
+        return f"/img-master/img/{self.upload_time.strftime(URL_TIME_FORMAT)}/{self.artwork_id}_p{page}_master1200.jpg"
+
+    def image_url(self, page: int = 0) -> str:
+        return f"https://{IMAGE_HOST}{self.image_path(page)}"
+
+    def illust_body(self) -> dict:
+        """The artwork as the /ajax/illust/<id> endpoint and preload-data describe it."""
+        master = f"https://{IMAGE_HOST}{self.master_path()}"
+        return {
+            'illustId': str(self.artwork_id),
+            'id': str(self.artwork_id),
+            'uploadDate': self.upload_time.isoformat(),
+            'pageCount': self.pages,
+            'urls': {
+                'small': master.replace('/img-master/', '/c/540x540_70/img-master/'),
+                'regular': master,
+                'original': self.image_url(),
+            },
+        }
+
+
+def _image_bytes(artwork_id: int, page: int, size: int) -> bytes:
+    """Deterministic content, so a resumed download can be checked byte for byte."""
+    seed = f"{artwork_id}_p{page}:".encode('ascii')
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+class MockPixivServer:
+    """
+    Local stand-in for i.pximg.net and www.pixiv.net, for benchmarks and offline runs.
+
+    Serves originals (HEAD, GET and Range), img-master previews, artwork pages
+    with preload-data and the /ajax/illust/<id> endpoint for the given artworks.
+    Every response waits latency plus up to jitter seconds. A random share of
+    image requests gets 403 (forbidden_rate), image requests without a Referer
+    always do, and above rate_limit requests per second the server answers 429
+    with Retry-After. Artwork pages are padded to about html_size bytes with
+    inline script, like the real ones. install() routes http_client requests
+    for both hosts here.
+    """
+
+    def __init__(self, artworks: Iterable[MockArtwork] = (), latency: float = 0.0, jitter: float = 0.0,
+                 forbidden_rate: float = 0.0, rate_limit: Optional[float] = None, retry_after: int = 1,
+                 seed: int = 0, html_size: int = 0, host: str = '127.0.0.1', port: int = 0):
+        self.artworks: Dict[int, MockArtwork] = {artwork.artwork_id: artwork for artwork in artworks}
+        self.latency = latency
+        self.jitter = jitter
+        self.forbidden_rate = forbidden_rate
+        self.retry_after = retry_after
+        self.html_size = html_size
+        self._bucket = TokenBucket(rate_limit) if rate_limit else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.statuses: Counter = Counter()
+        self.requests = 0
+        self.bytes_sent = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._server.request_queue_size = 256
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'MockPixivServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.uninstall()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def install(self):
+        """Send every http_client request for i.pximg.net and www.pixiv.net to this server."""
+        http_client.set_host_override(IMAGE_HOST, self.base_url)
+        http_client.set_host_override(PAGE_HOST, self.base_url)
+
+    def uninstall(self):
+        http_client.set_host_override(IMAGE_HOST, None)
+        http_client.set_host_override(PAGE_HOST, None)
+
+    def __enter__(self) -> 'MockPixivServer':
+        self.start()
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def add(self, artwork: MockArtwork):
+        self.artworks[artwork.artwork_id] = artwork
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'requests': self.requests, 'bytes_sent': self.bytes_sent,
+                    'statuses': dict(sorted(self.statuses.items()))}
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.statuses.clear()
+
+    def _record(self, status: int, sent: int):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += sent
+            self.statuses[status] += 1
+
+    def _delay(self) -> float:
+        with self._lock:
+            return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _forbidden(self) -> bool:
+        if not self.forbidden_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.forbidden_rate
+
+    def _throttled(self) -> bool:
+        return self._bucket is not None and not self._bucket.try_acquire()
+
+    def _image(self, path: str) -> Optional[bytes]:
+        match = _ORIGINAL_PATH.match(path)
+        if match:
+            time_path, artwork_id, page, extension = match.groups()
+            artwork = self.artworks.get(int(artwork_id))
+            if (artwork and artwork.upload_time.strftime(URL_TIME_FORMAT) == time_path
+                    and artwork.extension == extension and int(page) < artwork.pages):
+                return _image_bytes(artwork.artwork_id, int(page), artwork.page_size)
+            return None
+        match = _MASTER_PATH.match(path)
+        if match:
+            time_path, artwork_id, page = match.groups()
+            artwork = self.artworks.get(int(artwork_id))
+            if artwork and artwork.upload_time.strftime(URL_TIME_FORMAT) == time_path and int(page) < artwork.pages:
+                return _image_bytes(artwork.artwork_id, int(page), max(1, artwork.page_size // 8))
+        return None
+
+    def _page(self, artwork_id: int) -> Optional[bytes]:
+        artwork = self.artworks.get(artwork_id)
+        if artwork is None or not artwork.visible:
+            return None
+        preload = json.dumps({'illust': {str(artwork_id): artwork.illust_body()}})
+        return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>pixiv</title>'
+                f'<meta name="preload-data" id="meta-preload-data" content=\'{html.escape(preload)}\'>'
+                f'</head><body><div id="root"></div>{self._padding()}</body></html>').encode('utf-8')
+
+    def _padding(self) -> str:
+        filler = '<script>var pixiv = {};</script>'
+        return filler * (self.html_size // len(filler))
+
+    def _ajax(self, artwork_id: int) -> Optional[bytes]:
+        artwork = self.artworks.get(artwork_id)
+        if artwork is None or not artwork.visible:
+            return None
+        return json.dumps({'error': False, 'message': '', 'body': artwork.illust_body()}).encode('utf-8')
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; without this, small responses wait for delayed ACKs
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (ConnectionResetError, BrokenPipeError):
+                    pass   # 客户端提前关闭连接，例如流式检查已经得到结果
+
+            def do_HEAD(self):
+                self._respond(send_body=False)
+
+            def do_GET(self):
+                self._respond(send_body=True)
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes = b'', content_type: str = 'text/plain',
+                      headers: Optional[dict] = None, send_body: bool = True, length: Optional[int] = None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body) if length is None else length))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                sent = 0
+                if send_body and body:
+                    self.wfile.write(body)
+                    sent = len(body)
+                server._record(status, sent)
+
+            def _respond(self, send_body: bool):
+                delay = server._delay()
+                if delay:
+                    time.sleep(delay)
+                path = self.path.split('?', 1)[0]
+
+                if server._throttled():
+                    self._send(429, headers={'Retry-After': str(server.retry_after)}, send_body=send_body)
+                    return
+
+                if path.startswith(('/img-original/', '/img-master/', '/c/')):
+                    if 'pixiv.net' not in self.headers.get('Referer', '') or server._forbidden():
+                        self._send(403, b'Forbidden', send_body=send_body)
+                        return
+                    content = server._image(path)
+                    if content is None:
+                        self._send(404, b'Not Found', send_body=send_body)
+                        return
+                    self._send_image(content, path, send_body)
+                    return
+
+                match = _PAGE_PATH.match(path)
+                if match:
+                    page = server._page(int(match.group(1)))
+                    if page is None:
+                        page = NOT_FOUND_PAGE.replace(b'</body>', server._padding().encode('ascii') + b'</body>')
+                        self._send(404, page, 'text/html; charset=utf-8', send_body=send_body)
+                    else:
+                        self._send(200, page, 'text/html; charset=utf-8', send_body=send_body)
+                    return
+
+                match = _AJAX_PATH.match(path)
+                if match:
+                    body = server._ajax(int(match.group(1)))
+                    if body is None:
+                        error = {'error': True, 'message': 'Work has been deleted or the ID does not exist.', 'body': []}
+                        self._send(404, json.dumps(error).encode('utf-8'), 'application/json', send_body=send_body)
+                    else:
+                        self._send(200, body, 'application/json', send_body=send_body)
+                    return
+
+                self._send(404, b'Not Found', send_body=send_body)
+
+            def _send_image(self, content: bytes, path: str, send_body: bool):
+                content_type = 'image/png' if path.endswith('.png') else 'image/gif' if path.endswith('.gif') else 'image/jpeg'
+                size = len(content)
+                match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+                if not match:
+                    self._send(200, content, content_type, {'Accept-Ranges': 'bytes'}, send_body)
+                    return
+                start = int(match.group(1))
+                end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+                if start >= size:
+                    self._send(416, headers={'Content-Range': f'bytes */{size}'}, send_body=send_body)
+                    return
+                self._send(206, content[start:end + 1], content_type,
+                           {'Accept-Ranges': 'bytes', 'Content-Range': f'bytes {start}-{end}/{size}'}, send_body)
+
+        return Handler
+
+
+if __name__ == '__main__':
+    # 启动一个本地模拟服务器，手动用浏览器或 curl 访问
+    target = MockArtwork(123456789, datetime.datetime(2025, 7, 12, 12, 30, 17), 'png', pages=3, visible=False)
+    neighbors = [MockArtwork(123456780, datetime.datetime(2025, 7, 12, 12, 0, 0)),
+                 MockArtwork(123456790, datetime.datetime(2025, 7, 12, 13, 30, 15))]
+    server = MockPixivServer([target] + neighbors, latency=0.05, port=8080).start()
+    print(f"模拟服务器已启动: {server.base_url}")
+    print(f"隐藏的目标作品: {server.base_url}{target.image_path()}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
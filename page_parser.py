@@ -0,0 +1,163 @@
+import datetime
+import html
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional
+
+import http_client
+from find_adj import get_artwork_page_content
+from scheduler import parse_uri_datetime
+
+
+def build_illust_json_url(artwork_id: int) -> str:
+    """Build the compact illust JSON endpoint URL for an artwork ID."""
+    return f"https://www.pixiv.net/ajax/illust/{artwork_id}"
+
+
+@dataclass
+class ArtworkInfo:
+    """Upload time and image URI of a visible artwork, as needed for a neighbor URI."""
+    artwork_id: int
+    uri: str                            # img-original URI, or any date-bearing i.pximg.net URI
+    upload_time: datetime.datetime      # taken from the URI's img/YYYY/MM/DD/HH/MM/SS/ path
+    original_url: Optional[str] = None  # None when the page hides it (e.g. logged-out R-18)
+
+
+# <meta name="preload-data" id="meta-preload-data" content='{...}'>
+_PRELOAD_PATTERN = re.compile(r'<meta[^>]+id=["\']meta-preload-data["\'][^>]+content=(["\'])(.*?)\1', re.S)
+# <script id="__NEXT_DATA__" type="application/json">{...}</script>
+_NEXT_DATA_PATTERN = re.compile(r'<script[^>]+id=["\']__NEXT_DATA__["\'][^>]*>(.*?)</script>', re.S)
+_PXIMG_URL_PATTERN = re.compile(r'https://i\.pximg\.net/[^"\'\s<>\\]+')
+
+
+def _walk(node: Any) -> Iterator[Any]:
+    """Yield every value in a decoded JSON document, parsing JSON nested inside strings."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, dict):
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, str) and node[:1] in '{[':
+            # __NEXT_DATA__ keeps the preloaded state as a serialized JSON string
+            try:
+                stack.append(json.loads(node))
+            except ValueError:
+                pass
+
+
+def _info_from_urls(artwork_id: int, urls: Iterator[str]) -> Optional[ArtworkInfo]:
+    """Pick the best URI of this artwork's first page: the original if present, else any dated one."""
+    marker = f"/{artwork_id}_p0"
+    original = None
+    dated = None
+    for url in urls:
+        if not isinstance(url, str) or marker not in url or parse_uri_datetime(url) is None:
+            continue
+        if '/img-original/' in url:
+            original = original or url
+        else:
+            dated = dated or url
+    uri = original or dated
+    if uri is None:
+        return None
+    return ArtworkInfo(artwork_id, uri, parse_uri_datetime(uri), original)
+
+
+def _info_from_json(document: Any, artwork_id: int) -> Optional[ArtworkInfo]:
+    def urls():
+        for node in _walk(document):
+            if isinstance(node, dict) and isinstance(node.get('urls'), dict):
+                yield node['urls'].get('original')
+                yield from node['urls'].values()
+            elif isinstance(node, str) and node.startswith('https://i.pximg.net/'):
+                yield node
+    return _info_from_urls(artwork_id, urls())
+
+
+def parse_illust_json(text: str, artwork_id: int) -> Optional[ArtworkInfo]:
+    """Parse a response of the /ajax/illust/<id> endpoint. Returns None for errors."""
+    try:
+        document = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(document, dict) or document.get('error') or not document.get('body'):
+        return None
+    return _info_from_json(document['body'], artwork_id)
+
+
+def parse_artwork_page(html_content: str, artwork_id: int) -> Optional[ArtworkInfo]:
+    """
+    Extract the neighbor URI from an artwork page.
+
+    Tries the preload-data meta tag, then the __NEXT_DATA__ script, then any
+    i.pximg.net URL of the artwork's first page found in the raw HTML.
+    """
+    match = _PRELOAD_PATTERN.search(html_content)
+    if match:
+        try:
+            info = _info_from_json(json.loads(html.unescape(match.group(2))), artwork_id)
+        except ValueError:
+            info = None
+        if info:
+            return info
+
+    match = _NEXT_DATA_PATTERN.search(html_content)
+    if match:
+        try:
+            info = _info_from_json(json.loads(match.group(1)), artwork_id)
+        except ValueError:
+            info = None
+        if info:
+            return info
+
+    unescaped = html.unescape(html_content).replace('\\/', '/')
+    return _info_from_urls(artwork_id, (m.group(0) for m in _PXIMG_URL_PATTERN.finditer(unescaped)))
+
+
+def fetch_artwork_info(artwork_id: int) -> Optional[ArtworkInfo]:
+    """Get a neighbor URI for artwork_id from the illust JSON endpoint, falling back to the page."""
+    response = http_client.get(build_illust_json_url(artwork_id), headers=http_client.JSON_HEADERS)
+    if response.status_code == 200:
+        info = parse_illust_json(response.text, artwork_id)
+        if info:
+            return info
+
+    content = get_artwork_page_content(artwork_id)
+    if content is None:
+        return None
+    return parse_artwork_page(content, artwork_id)
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+if __name__ == '__main__':
+    # 使用 fixtures/ 中保存的页面离线检查解析结果
+    with open(os.path.join(FIXTURE_DIR, 'expected.json'), 'r', encoding='utf-8') as f:
+        expected = json.load(f)
+
+    failures = 0
+    for name, case in expected.items():
+        with open(os.path.join(FIXTURE_DIR, name), 'r', encoding='utf-8') as f:
+            content = f.read()
+        parse = parse_illust_json if name.endswith('.json') else parse_artwork_page
+        info = parse(content, case['artwork_id'])
+        got = None if info is None else {
+            'uri': info.uri,
+            'upload_time': info.upload_time.isoformat(),
+            'original_url': info.original_url,
+        }
+        want = case['result']
+        if got == want:
+            print(f"✅ {name}")
+        else:
+            failures += 1
+            print(f"❌ {name}\n   期望: {want}\n   实际: {got}")
+
+    print(f"\n{len(expected) - failures}/{len(expected)} 通过")
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+DEFAULT_CACHE_FILE = 'probe_cache.sqlite3'
+
+# Misses are re-checked after this many seconds; hits never expire
+DEFAULT_NEGATIVE_TTL = 3 * 24 * 3600
+
+# Statuses that settle a URL. Anything else (403, 429, 5xx, network errors) is retried next time.
+SETTLED_STATUSES = (200, 206, 404)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS probes (
+    url TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    checked_at REAL NOT NULL,
+    content_length INTEGER,
+    content_type TEXT
+);
+CREATE TABLE IF NOT EXISTS artworks (
+    artwork_id INTEGER PRIMARY KEY,
+    valid INTEGER NOT NULL,
+    checked_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    search_key TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+'''
+
+
+class ProbeCache:
+    """On-disk cache of probe outcomes, artwork existence and sweep checkpoints."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_FILE, negative_ttl: float = DEFAULT_NEGATIVE_TTL):
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _fresh(self, positive: bool, checked_at: float) -> bool:
+        return positive or time.time() - checked_at < self.negative_ttl
+
+    def get_probe(self, url: str) -> Optional[Tuple[int, Optional[int], Optional[str]]]:
+        """Return (status, content_length, content_type) if the URL is settled, else None."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT status, checked_at, content_length, content_type FROM probes WHERE url = ?',
+                (url,)).fetchone()
+        if row is None:
+            return None
+        status, checked_at, content_length, content_type = row
+        if not self._fresh(status != 404, checked_at):
+            return None
+        return status, content_length, content_type
+
+    def put_probe(self, url: str, status: int, content_length: Optional[int] = None,
+                  content_type: Optional[str] = None):
+        """Record a probe outcome. Unsettled statuses are ignored."""
+        if status not in SETTLED_STATUSES:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?)',
+                (url, status, time.time(), content_length, content_type))
+
+    def get_artwork(self, artwork_id: int) -> Optional[bool]:
+        """Return whether the artwork page was valid, or None if unknown or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT valid, checked_at FROM artworks WHERE artwork_id = ?', (artwork_id,)).fetchone()
+        if row is None or not self._fresh(bool(row[0]), row[1]):
+            return None
+        return bool(row[0])
+
+    def put_artwork(self, artwork_id: int, valid: bool):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO artworks VALUES (?, ?, ?)',
+                               (artwork_id, int(valid), time.time()))
+
+    def get_checkpoint(self, search_key: str) -> int:
+        """
+        Number of leading candidates already settled for this search.
+
+        The candidates behind a checkpoint are skipped without looking at their
+        cached misses, so a checkpoint started longer than negative_ttl ago is
+        dropped and the search starts over (still answered from the cache
+        where misses have not expired).
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT position, updated_at FROM checkpoints WHERE search_key = ?', (search_key,)).fetchone()
+            if row is None:
+                return 0
+            if not self._fresh(False, row[1]):
+                self._conn.execute('DELETE FROM checkpoints WHERE search_key = ?', (search_key,))
+                return 0
+        return row[0]
+
+    def save_checkpoint(self, search_key: str, position: int):
+        """Advance a checkpoint; its time stays that of the first save, when its oldest misses were checked."""
+        with self._lock, self._conn:
+            self._conn.execute('INSERT INTO checkpoints VALUES (?, ?, ?) '
+                               'ON CONFLICT (search_key) DO UPDATE SET position = excluded.position',
+                               (search_key, position, time.time()))
@@ -0,0 +1,433 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+import requests
+
+import http_client
+from metrics import Metrics
+from probe_cache import ProbeCache, SETTLED_STATUSES
+from rate_control import THROTTLE_STATUSES
+
+# Number of probes kept in flight at the same time
+DEFAULT_CONCURRENCY = 16
+
+# Probe methods: HEAD request, 1-byte Range GET, or a plain GET (headers only, body never read)
+PROBE_HEAD = 'head'
+PROBE_RANGE = 'range'
+PROBE_GET = 'get'
+PROBE_METHODS = (PROBE_HEAD, PROBE_RANGE, PROBE_GET)
+
+# Save the sweep checkpoint after this many newly settled candidates
+CHECKPOINT_INTERVAL = 256
+
+# Probe outcomes
+OUTCOME_HIT = 'hit'
+OUTCOME_MISS = 'miss'            # the URL definitely does not exist
+OUTCOME_THROTTLED = 'throttled'  # still 429/503 after http_client's own retries
+OUTCOME_ERROR = 'error'          # network error, timeout, 403 or 5xx: says nothing about the URL
+
+# Throttled and failed probes are sent again this many times before they count as unresolved
+DEFAULT_MAX_RETRIES = 3
+# Delay before the first retry, doubled for each further one
+RETRY_BACKOFF = 0.5
+
+# A probe still waiting after this latency quantile of the sweep gets a duplicate request
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_DELAY = 0.25
+# Latency samples needed before the quantile is trusted
+HEDGE_MIN_SAMPLES = 20
+# At most this share of probes is hedged, so hedging cannot double the load
+HEDGE_BUDGET = 0.05
+
+
+@dataclass
+class ProbeResult:
+    """Outcome of a single existence probe."""
+    url: str
+    status: Optional[int]
+    meta: Any = None
+    error: Optional[str] = None
+    content_length: Optional[int] = None
+    content_type: Optional[str] = None
+    cached: bool = False
+    attempts: int = 1
+
+    @property
+    def found(self) -> bool:
+        return self.status in (200, 206)
+
+    @property
+    def outcome(self) -> str:
+        if self.found:
+            return OUTCOME_HIT
+        if self.status == 404:
+            return OUTCOME_MISS
+        if self.status in THROTTLE_STATUSES:
+            return OUTCOME_THROTTLED
+        return OUTCOME_ERROR
+
+
+class _Attempt:
+    """One try of one candidate; a hedged attempt has two requests in flight."""
+
+    def __init__(self, index: int, url: str, meta: Any, number: int = 1):
+        self.index = index
+        self.url = url
+        self.meta = meta
+        self.number = number
+        self.started: Optional[float] = None   # when the first request actually started
+        self.in_flight = 0
+        self.hedged = False
+        self.settled = False
+
+
+def _full_length(response: requests.Response) -> Optional[int]:
+    """Total resource size, taken from Content-Range for 206 responses."""
+    if response.status_code == 206:
+        content_range = response.headers.get('Content-Range', '')
+        total = content_range.rpartition('/')[2]
+        if total.isdigit():
+            return int(total)
+        return None
+    length = response.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+class ProbeEngine:
+    """
+    Probe candidate URLs with bounded concurrency, stopping on the first hit.
+
+    Every probe ends as a hit, a definite miss, throttled or an error. The
+    last two say nothing about the URL, so the candidate is probed again
+    after a backoff, up to max_retries times; candidates still unanswered
+    after that are listed in unresolved. A probe that is slower than most
+    (see HEDGE_QUANTILE) gets one duplicate request and the first answer
+    wins; hedge_after fixes that delay instead, and hedge=False disables it.
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, timeout: float = http_client.DEFAULT_TIMEOUT,
+                 headers: Optional[dict] = None, method: str = PROBE_HEAD,
+                 cache: Optional[ProbeCache] = None, metrics: Optional[Metrics] = None,
+                 max_retries: int = DEFAULT_MAX_RETRIES, hedge: bool = True,
+                 hedge_after: Optional[float] = None):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if method not in PROBE_METHODS:
+            raise ValueError(f"Unknown probe method: {method}")
+        self.concurrency = concurrency
+        self.method = method
+        self.cache = cache
+        self.timeout = timeout
+        self.headers = headers if headers is not None else http_client.IMAGE_HEADERS
+        # Latency, status and error counts of the requests this engine sends
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.max_retries = max(0, max_retries)
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        # Outcome counts of the last run (final outcomes, after retries) and what stayed unanswered
+        self.outcomes: Counter = Counter()
+        self.unresolved: List[ProbeResult] = []
+        self.retries = 0
+        self.hedges = 0
+        # _stop ends one run (first hit, or the run finishing); _cancelled is set
+        # only by stop() and is never cleared, so every later run returns at once
+        self._stop = threading.Event()
+        self._cancelled = threading.Event()
+        http_client.ensure_pool_size(concurrency)
+
+    def stop(self):
+        """
+        Stop submitting new probes; probes already queued return without a request.
+        The engine stays cancelled: a run started later returns without probing.
+        """
+        self._cancelled.set()
+        self._stop.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def probe(self, url: str, meta: Any = None) -> ProbeResult:
+        """Check a single URL. Network errors are reported in the result, not raised."""
+        if self._stop.is_set():
+            return ProbeResult(url, None, meta, error='cancelled')
+        try:
+            response = self._request(url)
+        except requests.exceptions.RequestException as e:
+            return ProbeResult(url, None, meta, error=str(e))
+        return ProbeResult(url, response.status_code, meta,
+                           content_length=_full_length(response),
+                           content_type=response.headers.get('Content-Type'))
+
+    def _request(self, url: str) -> requests.Response:
+        """Send the probe without downloading the body, falling back when HEAD is refused."""
+        if self.method == PROBE_HEAD:
+            response = http_client.head(url, headers=self.headers, timeout=self.timeout, observer=self.metrics)
+            if response.status_code not in (405, 501):
+                return response
+
+        headers = dict(self.headers)
+        if self.method != PROBE_GET:
+            headers['Range'] = 'bytes=0-0'
+        # stream=True 只读取响应头; 如果 CDN 忽略 Range 返回 200, 也不会下载正文
+        response = http_client.get(url, headers=headers, timeout=self.timeout, stream=True, observer=self.metrics)
+        response.close()
+        if response.status_code == 416 and 'Range' in headers:
+            # 个别资源不接受 Range 请求，改用普通 GET（同样不读取正文）
+            del headers['Range']
+            response = http_client.get(url, headers=headers, timeout=self.timeout, stream=True,
+                                       observer=self.metrics)
+            response.close()
+        return response
+
+    def summary(self) -> dict:
+        """The Metrics summary with the outcome, retry and hedge counts of the last run."""
+        summary = self.metrics.summary()
+        summary['outcomes'] = dict(sorted(self.outcomes.items()))
+        summary['retries'] = self.retries
+        summary['hedges'] = self.hedges
+        return summary
+
+    def _attempt(self, attempt: _Attempt) -> ProbeResult:
+        if attempt.started is None:
+            attempt.started = time.monotonic()
+        return self.probe(attempt.url, attempt.meta)
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Seconds after which a probe is hedged, None while too few latencies are known."""
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if self.metrics.requests < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, self.metrics.latency_quantile(HEDGE_QUANTILE))
+
+    def _cached(self, url: str, meta: Any) -> Optional[ProbeResult]:
+        if self.cache is None:
+            return None
+        entry = self.cache.get_probe(url)
+        if entry is None:
+            return None
+        status, content_length, content_type = entry
+        return ProbeResult(url, status, meta, content_length=content_length,
+                           content_type=content_type, cached=True)
+
+    def run(self, candidates: Iterable[Tuple[str, Any]],
+            on_result: Optional[Callable[[ProbeResult], None]] = None,
+            stop_on_hit: bool = True,
+            checkpoint_key: Optional[str] = None) -> List[ProbeResult]:
+        """
+        Probe (url, meta) candidates and return the hits.
+
+        Candidates are pulled lazily, so at most about twice the concurrency is
+        queued at any time. on_result is called from the calling thread for every
+        completed probe. With stop_on_hit, no further probes are sent once the
+        first hit is confirmed and the remaining queued probes are cancelled.
+
+        With a cache, settled URLs are answered from disk without a request. With
+        a checkpoint_key as well, the number of leading candidates that are
+        settled is saved as the sweep goes, and a later run with the same key and
+        the same candidate order skips them without reporting them.
+
+        On an engine that was stopped, run() returns at once without probing.
+        """
+        self._stop.clear()
+        if self._cancelled.is_set():
+            self._stop.set()
+        self.outcomes = Counter()
+        self.unresolved = []
+        self.retries = self.hedges = 0
+        hits = []
+        iterator = enumerate(candidates)
+        exhausted = False
+        pending = {}   # future -> _Attempt
+        retry_queue = []   # (ready at, sequence, _Attempt) heap
+        sequence = itertools.count()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        # 对冲请求使用单独的线程池，不必排在普通探测之后
+        hedge_executor = ThreadPoolExecutor(max_workers=max(1, self.concurrency // 4)) if self.hedge else None
+        started_probes = 0
+
+        use_checkpoint = self.cache is not None and checkpoint_key is not None
+        position = self.cache.get_checkpoint(checkpoint_key) if use_checkpoint else 0
+        saved_position = position
+        settled_ahead = set()
+
+        def handle(index: int, result: ProbeResult):
+            nonlocal position, saved_position
+            self.outcomes[result.outcome] += 1
+            if on_result:
+                on_result(result)
+            if result.found:
+                hits.append(result)
+                if stop_on_hit:
+                    self._stop.set()
+            # 只有确定不存在的候选才计入断点，命中的候选在恢复时仍会被检查（由缓存直接返回）
+            if result.status in SETTLED_STATUSES and not result.found:
+                settled_ahead.add(index)
+                while position in settled_ahead:
+                    settled_ahead.remove(position)
+                    position += 1
+                if use_checkpoint and position - saved_position >= CHECKPOINT_INTERVAL:
+                    self.cache.save_checkpoint(checkpoint_key, position)
+                    saved_position = position
+            elif result.outcome in (OUTCOME_THROTTLED, OUTCOME_ERROR):
+                self.unresolved.append(result)
+
+        def submit(attempt: _Attempt, pool: ThreadPoolExecutor):
+            attempt.in_flight += 1
+            pending[pool.submit(self._attempt, attempt)] = attempt
+
+        try:
+            while True:
+                now = time.monotonic()
+                while (retry_queue and retry_queue[0][0] <= now and not self._stop.is_set()
+                       and len(pending) < self.concurrency * 2):
+                    submit(heapq.heappop(retry_queue)[2], executor)
+                while not exhausted and not self._stop.is_set() and len(pending) < self.concurrency * 2:
+                    try:
+                        index, (url, meta) = next(iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if index < position:
+                        continue
+                    cached = self._cached(url, meta)
+                    if cached is not None:
+                        handle(index, cached)
+                        continue
+                    submit(_Attempt(index, url, meta), executor)
+                    started_probes += 1
+
+                if self._stop.is_set():
+                    retry_queue.clear()
+                if not pending:
+                    if not retry_queue:
+                        break
+                    time.sleep(max(0.0, retry_queue[0][0] - time.monotonic()))
+                    continue
+
+                hedge_delay = self._hedge_delay() if hedge_executor is not None else None
+                timeout = None
+                if retry_queue:
+                    timeout = max(0.0, retry_queue[0][0] - now)
+                if hedge_delay is not None:
+                    timeout = min(timeout if timeout is not None else hedge_delay, hedge_delay / 4)
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    attempt = pending.pop(future)
+                    attempt.in_flight -= 1
+                    result = future.result()
+                    if attempt.settled or result.error == 'cancelled':
+                        continue
+                    retryable = result.outcome in (OUTCOME_THROTTLED, OUTCOME_ERROR)
+                    if retryable and attempt.in_flight:
+                        # 对冲的另一个请求仍在进行，由它决定结果
+                        continue
+                    attempt.settled = True
+                    # 另一个请求若也在本轮完成，留在 done 中，轮到它时因已确定而跳过
+                    for other in [f for f, a in pending.items() if a is attempt and f not in done]:
+                        other.cancel()
+                        del pending[other]
+                    if self.cache is not None and result.status is not None:
+                        self.cache.put_probe(result.url, result.status, result.content_length,
+                                             result.content_type)
+                    result.attempts = attempt.number
+                    if retryable and attempt.number <= self.max_retries and not self._stop.is_set():
+                        self.retries += 1
+                        delay = RETRY_BACKOFF * 2 ** (attempt.number - 1)
+                        heapq.heappush(retry_queue, (time.monotonic() + delay, next(sequence),
+                                                     _Attempt(attempt.index, attempt.url, attempt.meta,
+                                                              attempt.number + 1)))
+                        continue
+                    handle(attempt.index, result)
+
+                if hedge_delay is not None and not self._stop.is_set():
+                    now = time.monotonic()
+                    for attempt in list(pending.values()):
+                        if self.hedges >= HEDGE_BUDGET * started_probes:
+                            break
+                        if (not attempt.hedged and not attempt.settled and attempt.started is not None
+                                and now - attempt.started >= hedge_delay):
+                            attempt.hedged = True
+                            self.hedges += 1
+                            submit(attempt, hedge_executor)
+
+                if self._stop.is_set():
+                    break
+        finally:
+            # 不等待仍在进行中的请求，直接放弃其结果
+            self._stop.set()
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+            if hedge_executor is not None:
+                hedge_executor.shutdown(wait=False)
+            if use_checkpoint and position != saved_position:
+                self.cache.save_checkpoint(checkpoint_key, position)
+        return hits
+
+
+
+if __name__ == '__main__':
+    # 回归检查：对冲的两个请求在同一轮 wait() 中一起完成时，只报告一次结果
+    SLOW, FAST = 'https://example.invalid/1_p0.jpg', 'https://example.invalid/2_p0.jpg'
+
+    class _PairedEngine(ProbeEngine):
+        """
+        The slow candidate is hedged; the fast one answers once the hedge has
+        started, and both slow copies answer only while the fast result is
+        being reported.
+        """
+
+        def __init__(self):
+            super().__init__(concurrency=2, hedge_after=0.01, max_retries=0)
+            self.slow_calls = 0
+            self.slow_calls_done = 0
+            self._lock = threading.Lock()
+            self.hedge_started = threading.Event()
+            self.fast_reporting = threading.Event()
+            self.slow_done = threading.Event()
+
+        def probe(self, url: str, meta: Any = None) -> ProbeResult:
+            if url == FAST:
+                self.hedge_started.wait(5)
+                return ProbeResult(url, 404, meta)
+            with self._lock:
+                self.slow_calls += 1
+                calls = self.slow_calls
+            if calls == 2:
+                self.hedge_started.set()
+            self.fast_reporting.wait(5)
+            with self._lock:
+                self.slow_calls_done += 1
+                if self.slow_calls_done == 2:
+                    self.slow_done.set()
+            return ProbeResult(url, 404, meta)
+
+    engine = _PairedEngine()
+    reported = []
+
+    def on_result(result: ProbeResult):
+        reported.append(result.url)
+        if result.url == FAST:
+            # on_result runs on the calling thread: holding it here lets both copies of the
+            # slow candidate finish, so the next wait() returns them together
+            engine.fast_reporting.set()
+            engine.slow_done.wait(5)
+            time.sleep(0.1)
+
+    engine.run([(SLOW, None), (FAST, None)], on_result=on_result)
+    ok = engine.slow_calls == 2 and engine.hedges == 1 and sorted(reported) == [SLOW, FAST]
+    print(f"{'✅' if ok else '❌'} 对冲请求同时完成: 请求 {engine.slow_calls} 次, 报告 {len(reported)} 次, "
+          f"对冲 {engine.hedges} 次")
+    raise SystemExit(0 if ok else 1)
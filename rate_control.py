@@ -0,0 +1,161 @@
+import email.utils
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting requests per second across all threads."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available, without waiting."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+# Status codes that mean the server wants us to slow down
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class AdaptiveRateController:
+    """
+    Shared pacing for every request: a token bucket whose rate, and a cap on
+    requests in flight, follow AIMD.
+
+    Until the first throttling response the controller is in slow start: each
+    successful response raises the rate by one request per second, so the
+    rate doubles about every second of traffic and pacing does not hold back
+    a server that has not complained. After that, each successful response
+    raises the rate by about additive_increase per second of traffic and the
+    concurrency cap by about one per full window.
+    A 429 or 503 multiplies both by backoff_factor (at most once per
+    backoff_interval, so one burst of throttling counts once) and, when the
+    server sends Retry-After, pauses all requests until then.
+    """
+
+    def __init__(self, initial_rate: float = 100.0, min_rate: float = 1.0, max_rate: float = 500.0,
+                 max_concurrency: int = 128, additive_increase: float = 20.0,
+                 backoff_factor: float = 0.5, backoff_interval: float = 1.0, slow_start: bool = True):
+        if not 0 < min_rate <= max_rate:
+            raise ValueError("rates must satisfy 0 < min_rate <= max_rate")
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max(1, max_concurrency)
+        self.additive_increase = additive_increase
+        self.backoff_factor = backoff_factor
+        self.backoff_interval = backoff_interval
+        self._slow_start = slow_start
+        self._bucket = TokenBucket(min_rate)
+        self._set_rate(initial_rate)
+        self._concurrency_limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_backoff = 0.0
+        self._throttled = 0
+        self._cond = threading.Condition()
+
+    def _set_rate(self, rate: float):
+        rate = min(max(rate, self.min_rate), self.max_rate)
+        self._bucket.rate = rate
+        # 只允许约 0.1 秒的突发，降速后不会立刻放出大量积攒的令牌
+        self._bucket.burst = max(1.0, rate / 10)
+
+    @property
+    def current_rate(self) -> float:
+        return self._bucket.rate
+
+    @property
+    def concurrency_limit(self) -> int:
+        return max(1, int(self._concurrency_limit))
+
+    def snapshot(self) -> dict:
+        """Current controller state, for display and logging."""
+        with self._cond:
+            return {
+                'rate': round(self._bucket.rate, 2),
+                'concurrency_limit': self.concurrency_limit,
+                'in_flight': self._in_flight,
+                'paused_for': round(max(0.0, self._paused_until - time.monotonic()), 2),
+                'throttled': self._throttled,
+                'slow_start': self._slow_start,
+            }
+
+    def acquire(self):
+        """Block until a request may be sent; pair every call with release()."""
+        with self._cond:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                    continue
+                if self._in_flight < self.concurrency_limit:
+                    self._in_flight += 1
+                    break
+                self._cond.wait()
+        self._bucket.acquire()
+
+    def release(self, status: Optional[int] = None, retry_after: Optional[float] = None):
+        """Report how the request ended. status None means a network error."""
+        with self._cond:
+            self._in_flight -= 1
+            if status in THROTTLE_STATUSES:
+                self._throttled += 1
+                self._slow_start = False
+                now = time.monotonic()
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+                if now - self._last_backoff >= self.backoff_interval:
+                    self._last_backoff = now
+                    self._set_rate(self._bucket.rate * self.backoff_factor)
+                    self._concurrency_limit = max(1.0, self._concurrency_limit * self.backoff_factor)
+            elif status is not None and status < 500:
+                rate = self._bucket.rate
+                self._set_rate(rate + (1.0 if self._slow_start else self.additive_increase / max(rate, 1.0)))
+                self._concurrency_limit = min(float(self.max_concurrency),
+                                              self._concurrency_limit + 1.0 / self._concurrency_limit)
+            self._cond.notify_all()
@@ -1,93 +1,294 @@
-import requests
-import os
-import re
-import time
-
-def download_pixiv_gallery(start_url, download_dir):
-    """
-    根据给定的一个 Pixiv 图片 URL，下载整个作品集（p0, p1, ...）。
-
-    :param start_url: 作品集中任何一张图片的 URL。
-                      例如: "https://i.pximg.net/img-original/img/YYYY/MM/DD/HH/MM/SS/{ARTWORK_ID}_p0.png"
-    :param download_dir: 图片要保存到的本地文件夹路径。
-    """
-    
-    # 1. 使用正则表达式解析 URL，提取关键部分
-    # 模式: (基础路径)(作品ID)_p(页码)(.扩展名)
-    pattern = re.compile(r'(https?://.*/)(\d+)_p\d+(\..+)')
-    match = pattern.match(start_url)
-    
-    if not match:
-        print(f"错误：无法解析给定的 URL 格式。\n请确保 URL 类似于: '.../12345678_p0.png'")
-        return
-
-    base_url, illust_id, extension = match.groups()
-    print(f"解析成功:\n  - 作品ID: {illust_id}\n  - 文件格式: {extension}\n  - 基础路径: {base_url}")
-    
-    # 2. 准备请求头和下载目录
-    headers = {
-        'Referer': 'https://www.pixiv.net/',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'
-    }
-    
-    # 创建下载目录（如果不存在）
-    # exist_ok=True 可以在目录已存在时不引发错误
-    os.makedirs(download_dir, exist_ok=True)
-    print(f"文件将被下载到: {os.path.abspath(download_dir)}\n")
-
-    # 3. 循环遍历并下载
-    page_num = 0
-    while True:
-        # 构建当前页码的文件名和完整 URL
-        filename = f"{illust_id}_p{page_num}{extension}"
-        current_url = f"{base_url}{filename}"
-        
-        print(f"正在尝试下载: {filename} ... ", end="")
-        
-        try:
-            # 使用 stream=True 进行流式请求，适合下载文件
-            response = requests.get(current_url, headers=headers, stream=True, timeout=20)
-            
-            # 检查响应状态
-            if response.status_code == 200:
-                # 构建本地保存的完整路径
-                local_filepath = os.path.join(download_dir, filename)
-                
-                # 以二进制写模式打开文件，并写入内容
-                with open(local_filepath, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                
-                print(f"✅ 下载成功")
-                
-            elif response.status_code == 404:
-                print("❌ 未找到 (404 Not Found)。系列下载完成。")
-                break # 找不到文件，说明系列结束，退出循环
-            else:
-                print(f"❌ 失败 (HTTP 状态码: {response.status_code})")
-                break # 遇到其他错误也停止
-
-        except requests.exceptions.RequestException as e:
-            print(f"❌ 网络错误: {e}")
-            break # 遇到网络问题停止
-
-        # 准备下载下一张
-        page_num += 1
-        # 礼貌性地等待一下，避免过快请求
-        time.sleep(0.5)
-
-    print("\n所有任务已结束。")
-
-
-if __name__ == '__main__':
-    # --- 请在这里配置您的参数 ---
-
-    # 1. 给出系列中任何一张图片的 URL
-    TARGET_URL = "https://i.pximg.net/img-original/img/YYYY/MM/DD/HH/MM/SS/{ARTWORK_ID}_p0.png"
-    
-    # 2. 指定下载到的本地文件夹路径
-    # 在 Windows 上，路径中的反斜杠 `\` 最好写成 `\\` 或者使用 `/`
-    DOWNLOAD_PATH = r"C:\Downloads"
-
-    # --- 执行下载 ---
-    download_pixiv_gallery(TARGET_URL, DOWNLOAD_PATH)
\ No newline at end of file
+import requests
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import List, Optional
+
+import http_client
+from download_store import DownloadStore, open_store, HASH_CHUNK_SIZE
+from probe_engine import ProbeEngine, OUTCOME_HIT, OUTCOME_MISS
+
+# 同时下载的页数
+DEFAULT_DOWNLOAD_WORKERS = 4
+# 页数上限，防止异常情况下无限探测
+MAX_PAGES = 1000
+
+
+@dataclass
+class PageResult:
+    """单页的下载结果。"""
+    page: int
+    url: str
+    path: Optional[str] = None
+    ok: bool = False
+    status: Optional[int] = None
+    error: Optional[str] = None
+    size: int = 0        # 本次下载的字节数
+    skipped: bool = False  # 本地已有完整文件
+
+
+class PageCountError(OSError):
+    """探测页数时某一页在重试后仍没有得到回答（限流、403、超时等），页数无法确定。"""
+
+    def __init__(self, page, known_pages, reason):
+        super().__init__(f"page {page} got no answer: {reason}")
+        self.page = page
+        self.known_pages = known_pages  # 已确认存在的页数（p0 ~ p{known_pages - 1}）
+
+
+def count_gallery_pages(base_url, illust_id, extension, engine=None):
+    """
+    探测作品集的页数：先按 p1, p2, p4, p8... 指数探测，找到第一个不存在的页，
+    再在最后存在的页和它之间二分查找。只发送 HEAD 请求。
+
+    每页的探测经过 engine 的重试和退避，只有明确的 404 才算作不存在；
+    重试后仍失败时抛出 PageCountError，而不是把该页当作不存在。
+
+    :return: 页数（p0 存在时至少为 1），p0 不存在时返回 0。
+    """
+    engine = engine or ProbeEngine()
+    last_hit = -1
+
+    def exists(page):
+        results = []
+        engine.run([(f"{base_url}{illust_id}_p{page}{extension}", page)], on_result=results.append)
+        if not results or results[0].outcome not in (OUTCOME_HIT, OUTCOME_MISS):
+            reason = (results[0].error or f"HTTP {results[0].status}") if results else 'cancelled'
+            print(f"⚠️ 探测第 {page} 页时没有得到回答: {reason}")
+            raise PageCountError(page, last_hit + 1, reason)
+        return results[0].found
+
+    if not exists(0):
+        return 0
+
+    # 指数探测：last_hit 存在，miss 不存在
+    last_hit, probe = 0, 1
+    while probe < MAX_PAGES and exists(probe):
+        last_hit, probe = probe, probe * 2
+    miss = min(probe, MAX_PAGES)
+
+    # 二分查找最后一页
+    while miss - last_hit > 1:
+        middle = (last_hit + miss) // 2
+        if exists(middle):
+            last_hit = middle
+        else:
+            miss = middle
+    return last_hit + 1
+
+
+class IncompleteDownloadError(OSError):
+    """下载的字节数与服务器声明的文件大小不一致。"""
+
+
+def _expected_size(response, offset):
+    """根据响应头计算完整文件的大小，未知时返回 None。"""
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length')
+    return offset + int(length) if length and length.isdigit() else None
+
+
+def _hash_prefix(path):
+    """已下载部分的哈希，续传时在此基础上继续计算。"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest
+
+
+def download_page(url, local_filepath, store: Optional[DownloadStore] = None):
+    """
+    下载单页到 local_filepath，返回 (HTTP 状态码, 本次写入字节数, 是否跳过)。
+
+    内容先写入 "<文件名>.part"，如果上次中断留下了 .part 文件，则用 Range 请求
+    续传剩余部分。下载完成后校验文件大小，一致才原子地重命名为最终文件名，
+    因此最终文件存在即表示已完整下载，再次运行时直接跳过。
+
+    指定 store 时，清单中已有的 URL 不发送请求，直接链接到已存储的内容；
+    下载时边写边计算 SHA-256，完成后存入 store，内容重复的文件只保留一份。
+    """
+    if store is not None:
+        entry = store.lookup(url)
+        if entry is not None:
+            store.materialize(entry, local_filepath)
+            return 200, 0, True
+    if os.path.exists(local_filepath):
+        if store is not None:
+            # 旧版本下载的文件，补记到清单中
+            store.add(local_filepath, local_filepath, url, keep_source=True)
+        return 200, 0, True
+
+    part_path = local_filepath + '.part'
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = dict(http_client.IMAGE_HEADERS)
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+
+    # 使用 stream=True 进行流式请求，适合下载文件
+    response = http_client.get(url, headers=headers, stream=True, timeout=http_client.DOWNLOAD_TIMEOUT)
+    with response:
+        if response.status_code == 416 and offset:
+            # .part 已经包含完整内容（上次在重命名前中断）
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            if total.isdigit() and int(total) == offset:
+                if store is not None:
+                    store.add(part_path, local_filepath, url)
+                else:
+                    os.replace(part_path, local_filepath)
+                return 200, 0, False
+            # 大小对不上，丢弃 .part 下次重新下载
+            os.remove(part_path)
+            raise IncompleteDownloadError(f"partial file does not match remote size {total}")
+        if response.status_code not in (200, 206):
+            return response.status_code, 0, False
+        if response.status_code == 200:
+            # 服务器忽略了 Range，从头开始下载
+            offset = 0
+
+        expected = _expected_size(response, offset)
+        size = 0
+        digest = _hash_prefix(part_path) if offset else hashlib.sha256()
+        # 以二进制模式写入 .part 文件，续传时追加
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+
+    if expected is not None and offset + size != expected:
+        raise IncompleteDownloadError(f"got {offset + size} of {expected} bytes, will resume next time")
+    if store is not None:
+        store.add(part_path, local_filepath, url, digest.hexdigest())
+    else:
+        os.replace(part_path, local_filepath)
+    return 200, size, False
+
+
+def download_pixiv_gallery(start_url, download_dir, workers=DEFAULT_DOWNLOAD_WORKERS, page_count=None,
+                           store: Optional[DownloadStore] = None) -> List[PageResult]:
+    """
+    根据给定的一个 Pixiv 图片 URL，下载整个作品集（p0, p1, ...）。
+
+    先快速探测页数，再用多个线程并发下载所有页。本地已完整下载的页会被跳过，
+    中断留下的 .part 文件会续传。
+
+    下载的内容存入 download_dir 的 DownloadStore（按内容去重）。之前完整下载过的
+    作品集从清单中读取页数和文件，不发送任何请求。
+
+    :param start_url: 作品集中任何一张图片的 URL。
+                      例如: "https://i.pximg.net/img-original/img/YYYY/MM/DD/HH/MM/SS/{ARTWORK_ID}_p0.png"
+    :param download_dir: 图片要保存到的本地文件夹路径。
+    :param workers: 同时下载的页数。
+    :param page_count: 已知的页数；为 None 时自动探测。
+    :param store: 使用的 DownloadStore；为 None 时使用 download_dir 下的共享存储。
+    :return: 每一页的 PageResult 列表，按页码排序。
+    """
+
+    # 1. 使用正则表达式解析 URL，提取关键部分
+    # 模式: (基础路径)(作品ID)_p(页码)(.扩展名)
+    pattern = re.compile(r'(https?://.*/)(\d+)_p\d+(\..+)')
+    match = pattern.match(start_url)
+
+    if not match:
+        print(f"错误：无法解析给定的 URL 格式。\n请确保 URL 类似于: '.../12345678_p0.png'")
+        return []
+
+    base_url, illust_id, extension = match.groups()
+    print(f"解析成功:\n  - 作品ID: {illust_id}\n  - 文件格式: {extension}\n  - 基础路径: {base_url}")
+
+    # 2. 准备下载目录
+    # 创建下载目录（如果不存在）
+    # exist_ok=True 可以在目录已存在时不引发错误
+    os.makedirs(download_dir, exist_ok=True)
+    print(f"文件将被下载到: {os.path.abspath(download_dir)}\n")
+
+    store = store or open_store(download_dir)
+    gallery = f"{base_url}{illust_id}{extension}"
+
+    # 3. 探测页数
+    if page_count is None:
+        page_count = store.gallery_pages(gallery)
+        if page_count is not None:
+            print("清单中已有该作品集")
+    unknown_page = None
+    # 只有以明确的 404 结束的页数才记入清单，调用方给出的页数和探测失败时的页数都不记录
+    definite_count = False
+    if page_count is None:
+        try:
+            page_count = count_gallery_pages(base_url, illust_id, extension)
+            definite_count = page_count < MAX_PAGES
+        except PageCountError as e:
+            # 页数未知：先下载已确认存在的页，无法确认的那一页记为失败，下次运行再探测
+            page_count, unknown_page = e.known_pages, PageResult(e.page, f"{base_url}{illust_id}_p{e.page}{extension}",
+                                                                 error=str(e))
+            print(f"⚠️ 无法确定页数，先下载已确认存在的 {page_count} 页")
+    print(f"共 {page_count} 页\n")
+    if page_count == 0:
+        if unknown_page is not None:
+            print("⚠️ p0 没有得到回答，请稍后重试。")
+            return [unknown_page]
+        print("❌ 未找到 p0，没有可下载的内容。")
+        return []
+
+    # 4. 并发下载所有页
+    def download(page_num):
+        # 构建当前页码的文件名和完整 URL
+        filename = f"{illust_id}_p{page_num}{extension}"
+        result = PageResult(page_num, f"{base_url}{filename}", os.path.join(download_dir, filename))
+        try:
+            result.status, result.size, result.skipped = download_page(result.url, result.path, store)
+            result.ok = result.status == 200
+        except (requests.exceptions.RequestException, OSError) as e:
+            result.error = str(e)
+        return result
+
+    http_client.ensure_pool_size(workers)
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(download, page_num) for page_num in range(page_count)]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            filename = os.path.basename(result.path)
+            if result.skipped:
+                print(f"⏭️ {filename} 已存在，跳过")
+            elif result.ok:
+                print(f"✅ {filename} 下载成功 ({result.size} 字节)")
+            elif result.error:
+                print(f"❌ {filename} 网络错误: {result.error}")
+            else:
+                print(f"❌ {filename} 失败 (HTTP 状态码: {result.status})")
+
+    results.sort(key=lambda r: r.page)
+    succeeded = sum(1 for r in results if r.ok)
+    if definite_count and succeeded == page_count:
+        store.record_gallery(gallery, page_count)
+    if unknown_page is not None:
+        results.append(unknown_page)
+    print(f"\n所有任务已结束。成功 {succeeded}/{len(results)} 页。")
+    stats = store.stats()
+    print(f"存储中共 {stats['pages']} 页 ({stats['bytes']} 字节)，去重后 {stats['unique_objects']} 个文件 "
+          f"({stats['unique_bytes']} 字节)")
+    return results
+
+
+if __name__ == '__main__':
+    # --- 请在这里配置您的参数 ---
+
+    # 1. 给出系列中任何一张图片的 URL
+    TARGET_URL = "https://i.pximg.net/img-original/img/YYYY/MM/DD/HH/MM/SS/{ARTWORK_ID}_p0.png"
+
+    # 2. 指定下载到的本地文件夹路径
+    # 在 Windows 上，路径中的反斜杠 `\` 最好写成 `\\` 或者使用 `/`
+    DOWNLOAD_PATH = r"C:\Downloads"
+
+    # 3. 同时下载的页数
+    WORKERS = DEFAULT_DOWNLOAD_WORKERS
+
+    # --- 执行下载 ---
+    download_pixiv_gallery(TARGET_URL, DOWNLOAD_PATH, workers=WORKERS)
@@ -0,0 +1,215 @@
+import datetime
+import json
+import math
+import os
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar('T')
+
+# img-original/img-master URIs carry the full upload time: img/2025/05/12/22/30/17/
+URI_TIME_PATTERN = re.compile(r'img/(\d{4})/(\d{2})/(\d{2})/(\d{2})/(\d{2})/(\d{2})/')
+URL_TIME_FORMAT = '%Y/%m/%d/%H/%M/%S'
+
+# Candidate orders
+ORDER_INTERLEAVED = 'interleaved'    # every format at each second before moving on
+ORDER_WEIGHTED = 'weighted'          # formats advance through the window in proportion to their weight
+ORDER_FORMAT_FIRST = 'format-first'  # whole window per format (the old behaviour)
+ORDERS = (ORDER_INTERLEAVED, ORDER_WEIGHTED, ORDER_FORMAT_FIRST)
+
+FORMAT_STATS_FILE = 'format_stats.json'
+
+# Time orders within the window
+TIME_LINEAR = 'linear'    # from the previous artwork's timestamp forward
+TIME_SPIRAL = 'spiral'    # outward from the ID-interpolated estimate
+TIME_LEARNED = 'learned'  # most common past estimate errors first, then outward
+TIME_ORDERS = (TIME_LINEAR, TIME_SPIRAL, TIME_LEARNED)
+
+OFFSET_STATS_FILE = 'offset_stats.json'
+# Keep only the most recent estimate errors
+MAX_OFFSET_SAMPLES = 500
+# Width of one learned-order bucket, as a fraction of the window
+OFFSET_BUCKET = 0.05
+
+
+def schedule_candidates(timestamps: Callable[[], Iterable[T]], extensions: Sequence[str],
+                        order: str = ORDER_INTERLEAVED,
+                        weights: Optional[Dict[str, float]] = None) -> Iterator[Tuple[T, str]]:
+    """
+    Yield (timestamp, extension) pairs lazily in the requested order.
+
+    timestamps returns a fresh iterator over the window each time it is called;
+    orders that walk the window once per format call it once per format instead
+    of buffering one pass, so memory does not grow with the window.
+
+    With ORDER_WEIGHTED each format keeps its own cursor into the window and the
+    format whose cursor is least advanced relative to its weight goes next, so a
+    format seen twice as often is swept twice as fast. Equal weights give the
+    same sequence as ORDER_INTERLEAVED.
+    """
+    if order not in ORDERS:
+        raise ValueError(f"Unknown candidate order: {order}")
+    if not extensions:
+        return
+
+    if order == ORDER_FORMAT_FIRST:
+        for ext in extensions:
+            for ts in timestamps():
+                yield ts, ext
+        return
+
+    if order == ORDER_INTERLEAVED or not weights:
+        for ts in timestamps():
+            for ext in extensions:
+                yield ts, ext
+        return
+
+    # Formats never seen still get a small share so they are not starved
+    floor = max(weights.values(), default=1.0) * 0.05 or 1.0
+    rates = {ext: max(weights.get(ext, 0.0), floor) for ext in extensions}
+    ordered = sorted(extensions, key=lambda ext: -rates[ext])
+    # Each format walks its own pass over the window; a shared pass would buffer the gap between them
+    streams = {ext: iter(timestamps()) for ext in ordered}
+    sent = {ext: 0 for ext in ordered}
+    while streams:
+        ext = min(streams, key=lambda e: (sent[e] + 1) / rates[e])
+        try:
+            ts = next(streams[ext])
+        except StopIteration:
+            del streams[ext]
+            continue
+        sent[ext] += 1
+        yield ts, ext
+
+
+def load_format_weights(path: str = FORMAT_STATS_FILE) -> Dict[str, float]:
+    """Load how often each format has been found. Missing or broken files give no weights."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {ext: float(count) for ext, count in data.items() if isinstance(count, (int, float))}
+
+
+def record_format_hit(ext: str, path: str = FORMAT_STATS_FILE):
+    """Count a confirmed hit for ext so later weighted searches try it first."""
+    counts = load_format_weights(path)
+    counts[ext] = counts.get(ext, 0) + 1
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(counts, f)
+
+
+def estimate_offset(target_id: int, prev_id: int, next_id: int, window_seconds: int) -> int:
+    """
+    Estimate the target's upload second within the window by linear interpolation.
+
+    IDs rise roughly with upload time, so the target sits at about the same
+    fraction of the window as its ID does between the two neighbours.
+    """
+    if window_seconds <= 1 or next_id <= prev_id:
+        return 0
+    fraction = (target_id - prev_id) / (next_id - prev_id)
+    fraction = min(max(fraction, 0.0), 1.0)
+    return int(round(fraction * (window_seconds - 1)))
+
+
+def _outward(lo: int, hi: int, center: int) -> Iterator[int]:
+    """Yield lo..hi-1 by increasing distance from center, earlier second first on ties."""
+    if lo >= hi:
+        return
+    center = min(max(center, lo), hi - 1)
+    yield center
+    step = 1
+    while center - step >= lo or center + step < hi:
+        if center - step >= lo:
+            yield center - step
+        if center + step < hi:
+            yield center + step
+        step += 1
+
+
+def order_offsets(window_seconds: int, center: int = 0, strategy: str = TIME_LINEAR,
+                  residuals: Optional[Sequence[float]] = None) -> Iterator[int]:
+    """
+    Yield every second offset in [0, window_seconds) exactly once, lazily.
+
+    TIME_SPIRAL starts at center and alternates outward. TIME_LEARNED splits the
+    window into buckets of past estimate errors (as fractions of the window,
+    see record_offset) and visits the most frequent buckets first, spiralling
+    within each; without samples it behaves like TIME_SPIRAL.
+    """
+    if strategy not in TIME_ORDERS:
+        raise ValueError(f"Unknown time order: {strategy}")
+    if strategy == TIME_LINEAR:
+        yield from range(window_seconds)
+        return
+    if strategy == TIME_SPIRAL or not residuals:
+        yield from _outward(0, window_seconds, center)
+        return
+
+    width = max(1, int(math.ceil(window_seconds * OFFSET_BUCKET)))
+    counts: Dict[int, int] = {}
+    for r in residuals:
+        bucket = int(math.floor(r * window_seconds / width + 0.5))
+        counts[bucket] = counts.get(bucket, 0) + 1
+
+    # Buckets are centred on the estimate: bucket k covers center + k*width +- width/2
+    first = -int(math.ceil((center + 1) / width))
+    last = int(math.ceil((window_seconds - center) / width))
+    buckets = sorted(range(first, last + 1), key=lambda k: (-counts.get(k, 0), abs(k), k))
+    for k in buckets:
+        lo = max(0, center + k * width - width // 2)
+        hi = min(window_seconds, center + k * width - width // 2 + width)
+        yield from _outward(lo, hi, center + k * width)
+
+
+def load_offset_residuals(path: str = OFFSET_STATS_FILE) -> List[float]:
+    """Load past estimate errors, as fractions of their search window."""
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+    return [float(r) for r in data if isinstance(r, (int, float))]
+
+
+def record_offset(found_offset: int, estimated_offset: int, window_seconds: int,
+                  path: str = OFFSET_STATS_FILE):
+    """Remember how far a hit was from the interpolated estimate."""
+    if window_seconds <= 0:
+        return
+    residuals = load_offset_residuals(path)
+    residuals.append((found_offset - estimated_offset) / window_seconds)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(residuals[-MAX_OFFSET_SAMPLES:], f)
+
+
+def parse_uri_datetime(uri: str) -> Optional[datetime.datetime]:
+    """Extract the full upload datetime from an i.pximg.net URI, or None if absent."""
+    match = URI_TIME_PATTERN.search(uri)
+    if not match:
+        return None
+    return datetime.datetime(*(int(part) for part in match.groups()))
+
+
+def window_size(start: datetime.datetime, end: datetime.datetime) -> int:
+    """Number of whole seconds in [start, end], computed without enumerating them."""
+    if end < start:
+        raise ValueError("Window end is earlier than its start")
+    return int((end - start).total_seconds()) + 1
+
+
+def window_times(start: datetime.datetime, offsets: Iterable[int]) -> Iterator[Tuple[int, str]]:
+    """
+    Map second offsets to (offset, URL path) pairs lazily.
+
+    The path contains the date as well as the time, so windows may cross
+    midnight or span several days.
+    """
+    for offset in offsets:
+        yield offset, (start + datetime.timedelta(seconds=offset)).strftime(URL_TIME_FORMAT)
@@ -0,0 +1,431 @@
+import bisect
+import datetime
+import hashlib
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from probe_engine import ProbeEngine
+from scheduler import (schedule_candidates, load_format_weights, record_format_hit,
+                       estimate_offset, order_offsets, load_offset_residuals, record_offset,
+                       parse_uri_datetime, window_size, window_times, URL_TIME_FORMAT,
+                       ORDER_INTERLEAVED, ORDER_WEIGHTED, TIME_SPIRAL, TIME_LINEAR, TIME_LEARNED)
+
+DEFAULT_EXTENSIONS = ('jpg', 'png')
+
+# Format: https://i.pximg.net/img-original/img/{time}/ARTWORK_ID_p0
+ORIGINAL_URL_TEMPLATE = "https://i.pximg.net/img-original/img/{{time}}/{target_id}_p0"
+
+# The img-master preview shares the original's date path and is always a JPEG:
+# https://i.pximg.net/img-master/img/{time}/ARTWORK_ID_p0_master1200.jpg
+MASTER_URL_TEMPLATE = "https://i.pximg.net/img-master/img/{{time}}/{target_id}_p0_master1200"
+
+
+@dataclass
+class SearchResult:
+    """Outcome of one target's timestamp sweep."""
+    target_id: int
+    url: Optional[str] = None
+    timestamp: Optional[datetime.datetime] = None
+    extension: Optional[str] = None
+    content_length: Optional[int] = None
+    probes: int = 0    # requests actually sent
+    checked: int = 0   # candidates settled, including cached ones
+    total: int = 0     # candidates in the whole window
+    metrics: Optional[dict] = None  # the engine's Metrics summary when the sweep ended
+    # Candidates never answered (throttled or failing after every retry), as "YYYY-mm-dd HH:MM:SS ext";
+    # a target not found with unresolved candidates may still exist at one of them
+    unresolved: List[str] = field(default_factory=list)
+
+    @property
+    def found(self) -> bool:
+        return self.url is not None
+
+    @property
+    def conclusive(self) -> bool:
+        """Whether a result without a hit really means the whole window was answered."""
+        return self.found or not self.unresolved
+
+
+def extract_time_range(prev_uri: str, next_uri: str,
+                       target_id: int) -> Tuple[datetime.datetime, datetime.datetime, str]:
+    """Extract the full upload datetimes from URIs and build the target's URL template."""
+    # Extract date and time from URI pattern: img/2025/05/12/22/30/17/
+    prev_time = parse_uri_datetime(prev_uri)
+    next_time = parse_uri_datetime(next_uri)
+
+    if prev_time is None or next_time is None:
+        raise ValueError("Unable to extract time information from URI")
+    if next_time < prev_time:
+        raise ValueError("Next artwork URI is earlier than the previous artwork URI")
+
+    # The date is part of {time}, so windows crossing midnight or spanning
+    # several days are searched correctly
+    return prev_time, next_time, ORIGINAL_URL_TEMPLATE.format(target_id=target_id)
+
+
+def extract_neighbor_ids(prev_uri: str, next_uri: str) -> Optional[Tuple[int, int]]:
+    """Extract artwork IDs from the neighbor URIs, e.g. .../123456789_p0.jpg"""
+    pattern = r'/(\d+)_p\d+'
+    prev_match = re.search(pattern, prev_uri)
+    next_match = re.search(pattern, next_uri)
+    if not prev_match or not next_match:
+        return None
+    return int(prev_match.group(1)), int(next_match.group(1))
+
+
+def search_artwork(target_id: int, prev_uri: str, next_uri: str,
+                   extensions: Sequence[str] = DEFAULT_EXTENSIONS,
+                   engine: Optional[ProbeEngine] = None,
+                   order: str = ORDER_INTERLEAVED,
+                   time_order: str = TIME_SPIRAL,
+                   log: Callable[[str], None] = print,
+                   on_progress: Optional[Callable[[int, int, str], None]] = None,
+                   two_phase: bool = False) -> SearchResult:
+    """
+    Sweep the window between two neighbor URIs for the target's p0 original.
+
+    Candidates are probed through engine (which carries the concurrency, probe
+    method and cache); the sweep checkpoints and resumes when the engine has a
+    cache. on_progress is called with (checked, total, message) per candidate.
+
+    With two_phase, the window is swept once for the img-master preview, which
+    has a single extension, and the original is then looked up in each format
+    at the second found. If the preview exists but no original does, the
+    result has a timestamp but no url.
+    """
+    extensions = list(extensions)
+    if not extensions:
+        raise ValueError("At least one file extension is required")
+    engine = engine or ProbeEngine()
+    result = SearchResult(target_id)
+
+    prev_time, next_time, base_url = extract_time_range(prev_uri, next_uri, target_id)
+    log(f"Time range: {prev_time:%Y-%m-%d %H:%M:%S} to {next_time:%Y-%m-%d %H:%M:%S}")
+    log(f"Base URL template: {base_url}")
+    log(f"Searching file types: {', '.join(extensions)}")
+
+    # Phase one of a two-phase search sweeps only the preview
+    if two_phase:
+        sweep_url, sweep_extensions = MASTER_URL_TEMPLATE.format(target_id=target_id), ['jpg']
+        log("Two-phase search: locating the upload time through the img-master preview")
+    else:
+        sweep_url, sweep_extensions = base_url, extensions
+
+    # Calculate total possible checks
+    time_range_seconds = window_size(prev_time, next_time)
+    total_checks = result.total = len(sweep_extensions) * time_range_seconds
+    log(f"Total time range: {time_range_seconds} seconds")
+    log(f"Maximum possible checks: {total_checks}")
+
+    weights = load_format_weights() if order == ORDER_WEIGHTED else None
+
+    # Start at the ID-interpolated upload second when the neighbor IDs are known
+    neighbor_ids = extract_neighbor_ids(prev_uri, next_uri)
+    estimated = 0
+    if neighbor_ids:
+        estimated = estimate_offset(target_id, neighbor_ids[0], neighbor_ids[1], time_range_seconds)
+        log(f"Estimated upload time: {prev_time + datetime.timedelta(seconds=estimated):%Y-%m-%d %H:%M:%S}")
+    elif time_order != TIME_LINEAR:
+        log("Unable to read neighbor IDs from URIs, searching from the previous artwork")
+        time_order = TIME_LINEAR
+    residuals = load_offset_residuals() if time_order == TIME_LEARNED else None
+
+    def timestamps():
+        return window_times(prev_time, order_offsets(time_range_seconds, estimated, time_order, residuals))
+
+    def candidates():
+        for (offset, time_for_url), ext in schedule_candidates(timestamps, sweep_extensions, order, weights):
+            yield f"{sweep_url.replace('{time}', time_for_url)}.{ext}", (offset, time_for_url, ext)
+
+    def on_result(probe):
+        result.checked += 1
+        if not probe.cached:
+            result.probes += 1
+        engine.metrics.set_progress(result.checked, total_checks)
+        if on_progress:
+            _, time_for_url, ext = probe.meta
+            kind = "preview" if two_phase else ext.upper()
+            on_progress(result.checked, total_checks, f"Checking {kind} at {time_for_url}")
+
+    # The checkpoint is only valid for the exact same candidate order
+    checkpoint_key = hashlib.sha1(json.dumps(
+        [sweep_url, prev_time.isoformat(), next_time.isoformat(), sweep_extensions, order, weights,
+         time_order, estimated, residuals]
+    ).encode('utf-8')).hexdigest()
+    if engine.cache is not None:
+        result.checked = engine.cache.get_checkpoint(checkpoint_key)
+        if result.checked:
+            log(f"Resuming from checkpoint: {result.checked} candidates already checked")
+    engine.metrics.begin_progress(result.checked, total_checks)
+
+    def unresolved():
+        return [f"{prev_time + datetime.timedelta(seconds=probe.meta[0]):%Y-%m-%d %H:%M:%S} {probe.meta[2]}"
+                for probe in engine.unresolved]
+
+    hits = engine.run(candidates(), on_result=on_result, checkpoint_key=checkpoint_key)
+    result.unresolved = unresolved()
+    sweep_counts = None
+    if hits and two_phase:
+        # The next run resets the engine's outcome counts; keep the sweep's to add them up
+        sweep_counts = (engine.outcomes, engine.retries, engine.hedges)
+        found_offset, time_for_url, _ = hits[0].meta
+        result.timestamp = prev_time + datetime.timedelta(seconds=found_offset)
+        log(f"Preview found at {time_for_url}: {hits[0].url}")
+        if engine.cancelled:
+            log("Cancelled before looking up the original")
+            hits = []
+        else:
+            hits = _resolve_original(engine, base_url, time_for_url, found_offset, extensions, result)
+            # The upload time is known now; only unanswered original checks leave the result open
+            result.unresolved = unresolved()
+            if not hits and not result.unresolved:
+                log(f"❌ No original in {', '.join(extensions)} at {time_for_url}")
+    result.metrics = engine.summary()
+    if sweep_counts is not None:
+        outcomes, retries, hedges = sweep_counts
+        result.metrics['outcomes'] = dict(sorted((outcomes + engine.outcomes).items()))
+        result.metrics['retries'] += retries
+        result.metrics['hedges'] += hedges
+    log(f"Requests: {engine.metrics.status_line()}")
+    if hits:
+        hit = hits[0]
+        found_offset, _, result.extension = hit.meta
+        result.url = hit.url
+        result.timestamp = prev_time + datetime.timedelta(seconds=found_offset)
+        result.content_length = hit.content_length
+        record_format_hit(result.extension)
+        if neighbor_ids:
+            record_offset(found_offset, estimated, time_range_seconds)
+        log(f"✅ Found {result.extension.upper()} format resource: {hit.url} "
+            f"({hit.content_type}, {hit.content_length} bytes)")
+    elif result.unresolved:
+        log(f"⚠️ {len(result.unresolved)} candidates got no answer after {engine.max_retries} retries, "
+            f"not found is inconclusive: {', '.join(result.unresolved[:10])}")
+    return result
+
+
+
+def _resolve_original(engine: ProbeEngine, base_url: str, time_for_url: str, offset: int,
+                      extensions: Sequence[str], result: SearchResult) -> list:
+    """Probe the original in every format at one second, most often found format first."""
+    weights = load_format_weights()
+    ordered = sorted(extensions, key=lambda ext: -weights.get(ext, 0.0))
+    candidates = [(f"{base_url.replace('{time}', time_for_url)}.{ext}", (offset, time_for_url, ext))
+                  for ext in ordered]
+
+    def on_result(probe):
+        if not probe.cached:
+            result.probes += 1
+
+    return engine.run(candidates, on_result=on_result)
+
+
+class _ClusterTarget:
+    """Sweep state of one target in a coalesced search."""
+
+    def __init__(self, target_id: int, base_url: str, window_seconds: int):
+        self.result = SearchResult(target_id)
+        self.base_url = base_url
+        # Inclusive bounds of the target's sub-window, narrowed as other targets are found
+        self.lo = 0
+        self.hi = window_seconds - 1
+        self.estimate = 0
+        self.probed: Set[Tuple[int, str]] = set()
+        self.exhausted = False
+        self._stream = iter(())
+
+    @property
+    def target_id(self) -> int:
+        return self.result.target_id
+
+    @property
+    def active(self) -> bool:
+        return not self.result.found and not self.exhausted
+
+    def restart(self, extensions, order, weights, time_order, residuals):
+        """Sweep the current sub-window again from the current estimate, skipping probed candidates."""
+        if self.lo > self.hi:
+            self.exhausted = True
+            return
+        size = self.hi - self.lo + 1
+        center = min(max(self.estimate, self.lo), self.hi) - self.lo
+        lo = self.lo
+
+        def offsets():
+            return (lo + offset for offset in order_offsets(size, center, time_order, residuals))
+
+        self._stream = schedule_candidates(offsets, extensions, order, weights)
+
+    def next_candidate(self) -> Optional[Tuple[int, str]]:
+        for offset, ext in self._stream:
+            if (offset, ext) not in self.probed and self.lo <= offset <= self.hi:
+                self.probed.add((offset, ext))
+                return offset, ext
+        self.exhausted = True
+        return None
+
+
+def _interpolate(target_id: int, anchors: List[Tuple[int, int]]) -> int:
+    """Estimate an offset from the nearest (ID, offset) anchors below and above target_id."""
+    below = max((a for a in anchors if a[0] < target_id), default=anchors[0])
+    above = min((a for a in anchors if a[0] > target_id), default=anchors[-1])
+    if above[0] <= below[0]:
+        return below[1]
+    return below[1] + estimate_offset(target_id, below[0], above[0], above[1] - below[1] + 1)
+
+
+def search_cluster(target_ids: Sequence[int], prev_uri: str, next_uri: str,
+                   extensions: Sequence[str] = DEFAULT_EXTENSIONS,
+                   engine: Optional[ProbeEngine] = None,
+                   order: str = ORDER_INTERLEAVED,
+                   time_order: str = TIME_SPIRAL,
+                   log: Callable[[str], None] = print,
+                   on_progress: Optional[Callable[[int, int, str], None]] = None) -> Dict[int, SearchResult]:
+    """
+    Sweep one window for several targets that share the same two neighbors.
+
+    IDs rise with upload time, so a hit at offset t bounds every smaller ID
+    to [.., t] and every larger ID to [t, ..]. The resolved targets (found or
+    not) and the neighbors split the IDs into gaps, and the median unresolved
+    target of each gap is swept next, outward from its estimate interpolated
+    between the nearest found IDs. Their candidates are interleaved
+    round-robin and found targets drop out.
+
+    While every swept target is found, targets swept together have disjoint
+    sub-windows, each round costs at most one window, and the cluster costs
+    about one window of probes instead of one per target (about log2(N + 1)
+    windows at worst). A target that is not found gives no upload time: its
+    whole sub-window is swept, and the targets on either side of it are then
+    swept over the same, overlapping sub-window. Missing targets can therefore
+    cost up to one more window each.
+
+    The candidate order depends on when hits arrive, so no checkpoint is kept;
+    with a cache on the engine, a rerun still skips every settled URL.
+    Returns a SearchResult per target ID.
+    """
+    extensions = list(extensions)
+    if not extensions:
+        raise ValueError("At least one file extension is required")
+    ids = sorted(set(target_ids))
+    if not ids:
+        raise ValueError("At least one target ID is required")
+    engine = engine or ProbeEngine()
+
+    prev_time, next_time, _ = extract_time_range(prev_uri, next_uri, ids[0])
+    window_seconds = window_size(prev_time, next_time)
+    total_checks = len(extensions) * window_seconds
+    log(f"Time range: {prev_time:%Y-%m-%d %H:%M:%S} to {next_time:%Y-%m-%d %H:%M:%S}")
+    log(f"Searching {len(ids)} targets: {', '.join(map(str, ids))}")
+    log(f"Total time range: {window_seconds} seconds, {total_checks} checks per target")
+
+    weights = load_format_weights() if order == ORDER_WEIGHTED else None
+    neighbor_ids = extract_neighbor_ids(prev_uri, next_uri)
+    if neighbor_ids is None and time_order != TIME_LINEAR:
+        log("Unable to read neighbor IDs from URIs, searching from the previous artwork")
+        time_order = TIME_LINEAR
+    residuals = load_offset_residuals() if time_order == TIME_LEARNED else None
+
+    targets = [_ClusterTarget(target_id, ORIGINAL_URL_TEMPLATE.format(target_id=target_id), window_seconds)
+               for target_id in ids]
+    by_id = {target.target_id: target for target in targets}
+    # (ID, offset) pairs whose upload time is known: the neighbors, then each found target
+    anchors = [(neighbor_ids[0], 0), (neighbor_ids[1], window_seconds - 1)] if neighbor_ids else []
+
+    def restart(target: _ClusterTarget):
+        if anchors:
+            target.estimate = _interpolate(target.target_id, sorted(anchors))
+        target.restart(extensions, order, weights, time_order, residuals)
+
+    for target in targets:
+        restart(target)
+        if anchors:
+            log(f"Estimated upload time of {target.target_id}: "
+                f"{prev_time + datetime.timedelta(seconds=target.estimate):%Y-%m-%d %H:%M:%S}")
+
+    bounds = list(neighbor_ids) if neighbor_ids else []
+
+    def eligible() -> List[_ClusterTarget]:
+        # Resolved targets and the neighbors split the IDs into gaps; only the median
+        # unresolved target of each gap is swept, so their sub-windows do not overlap
+        separators = sorted(bounds + [t.target_id for t in targets if not t.active])
+        gaps: Dict[int, List[_ClusterTarget]] = {}
+        for target in targets:
+            if target.active:
+                gaps.setdefault(bisect.bisect_left(separators, target.target_id), []).append(target)
+        return [gap[len(gap) // 2] for gap in gaps.values()]
+
+    def candidates():
+        while True:
+            active = eligible()
+            if not active:
+                return
+            for target in active:
+                # A hit earlier in this pass may have resolved or exhausted it
+                if not target.active:
+                    continue
+                candidate = target.next_candidate()
+                if candidate is None:
+                    continue
+                offset, ext = candidate
+                time_for_url = (prev_time + datetime.timedelta(seconds=offset)).strftime(URL_TIME_FORMAT)
+                yield f"{target.base_url.replace('{time}', time_for_url)}.{ext}", (target.target_id, offset, ext)
+
+    checked = 0
+    engine.metrics.begin_progress(0, total_checks)
+
+    def on_result(probe):
+        nonlocal checked
+        target_id, offset, ext = probe.meta
+        target = by_id[target_id]
+        checked += 1
+        target.result.checked += 1
+        if not probe.cached:
+            target.result.probes += 1
+        engine.metrics.set_progress(min(checked, total_checks), total_checks)
+        if on_progress:
+            on_progress(min(checked, total_checks), total_checks, f"Checking {target_id} {ext.upper()} at offset {offset}s")
+        if not probe.found or target.result.found:
+            return
+
+        result = target.result
+        result.url, result.extension = probe.url, ext
+        result.timestamp = prev_time + datetime.timedelta(seconds=offset)
+        result.content_length = probe.content_length
+        record_format_hit(ext)
+        if anchors:
+            record_offset(offset - target.lo, target.estimate - target.lo, target.hi - target.lo + 1)
+            anchors.append((target_id, offset))
+        log(f"✅ Found {target_id} ({ext.upper()}): {probe.url}")
+
+        for other in targets:
+            if not other.active:
+                continue
+            if other.target_id < target_id and offset < other.hi:
+                other.hi = offset
+            elif other.target_id > target_id and offset > other.lo:
+                other.lo = offset
+            else:
+                continue
+            restart(other)
+
+    engine.run(candidates(), on_result=on_result, stop_on_hit=False)
+    for probe in engine.unresolved:
+        target_id, offset, ext = probe.meta
+        by_id[target_id].result.unresolved.append(
+            f"{prev_time + datetime.timedelta(seconds=offset):%Y-%m-%d %H:%M:%S} {ext}")
+
+    summary = engine.summary()
+    probes = sum(target.result.probes for target in targets)
+    found = [target for target in targets if target.result.found]
+    log(f"Found {len(found)}/{len(targets)} targets with {probes} probes "
+        f"({probes / max(1, window_seconds * len(extensions)):.2f} windows)")
+    log(f"Requests: {engine.metrics.status_line()}")
+    for target in targets:
+        if not target.result.conclusive:
+            log(f"⚠️ {target.target_id}: {len(target.result.unresolved)} candidates got no answer, "
+                f"not found is inconclusive")
+        target.result.total = total_checks
+        target.result.metrics = summary
+    return {target.target_id: target.result for target in targets}
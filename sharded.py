@@ -0,0 +1,520 @@
+import argparse
+import datetime
+import heapq
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+import http_client
+from batch import (read_jobs, load_finished, ResultWriter, STATUS_FOUND, STATUS_NOT_FOUND, STATUS_INCOMPLETE,
+                   STATUS_NEEDS_URIS, STATUS_ERROR)
+from find_adj import find_adjacent_valid_artworks
+from page_parser import fetch_artwork_info
+from probe_engine import ProbeEngine, DEFAULT_CONCURRENCY
+from rate_control import AdaptiveRateController
+from scheduler import (schedule_candidates, order_offsets, estimate_offset, window_size, window_times,
+                       record_format_hit, ORDER_INTERLEAVED, TIME_SPIRAL)
+from search import extract_time_range, extract_neighbor_ids, DEFAULT_EXTENSIONS
+from time_index import TimeIndex, INDEX_WINDOW_LIMIT
+
+# Seconds of a window per shard; with two formats a shard is about 600 probes
+DEFAULT_SHARD_SECONDS = 300
+
+# A lease not renewed for this many seconds is handed to another worker
+DEFAULT_LEASE_SECONDS = 15.0
+
+DEFAULT_PORT = 8765
+
+
+@dataclass
+class Shard:
+    """Seconds [lo, hi) of one target's window, probed by one worker at a time."""
+    shard_id: int
+    target_id: int
+    base_url: str              # target URL template with {time}
+    start: datetime.datetime   # first second of the whole window
+    lo: int
+    hi: int
+    estimate: int              # the target's estimated offset in the whole window
+    extensions: List[str]
+
+    def to_json(self) -> dict:
+        return {'id': self.shard_id, 'target': self.target_id, 'base_url': self.base_url,
+                'start': self.start.isoformat(), 'lo': self.lo, 'hi': self.hi,
+                'estimate': self.estimate, 'extensions': self.extensions}
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'Shard':
+        return cls(data['id'], data['target'], data['base_url'], datetime.datetime.fromisoformat(data['start']),
+                   data['lo'], data['hi'], data['estimate'], list(data['extensions']))
+
+
+@dataclass
+class _Lease:
+    shard: Shard
+    worker: str
+    expires: float
+    checked: int = 0
+
+
+@dataclass
+class _Target:
+    target_id: int
+    prev_uri: str
+    next_uri: str
+    start: datetime.datetime
+    total: int
+    shards_left: int
+    started: float = field(default_factory=time.time)
+    probes: int = 0
+    hit: Optional[dict] = None
+    done: bool = False
+    # (offset, extension) candidates a worker got no answer for
+    unresolved: List[Tuple[int, str]] = field(default_factory=list)
+
+
+class Coordinator:
+    """
+    Split search windows into shards and lease them to workers.
+
+    Shards nearest the ID-interpolated estimate are leased first, the shards
+    of several targets interleaved. A worker renews its lease while probing;
+    a lease that is not renewed in time (the worker died or lost its
+    connection) goes back to the queue. Once a shard reports a hit, the
+    target's other shards are dropped and every worker still probing one is
+    told to stop at its next renewal. on_finish is called with a result record
+    for every target, found or not.
+    """
+
+    def __init__(self, extensions=DEFAULT_EXTENSIONS, shard_seconds: int = DEFAULT_SHARD_SECONDS,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 on_finish: Optional[Callable[[dict], None]] = None):
+        self.extensions = list(extensions)
+        self.shard_seconds = shard_seconds
+        self.lease_seconds = lease_seconds
+        self.on_finish = on_finish
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)
+        self._queue: List[Tuple[int, int, Shard]] = []   # (rank, shard_id, shard) heap
+        self._leases: Dict[str, _Lease] = {}
+        self._targets: Dict[int, _Target] = {}
+        self._shard_ids = itertools.count()
+        self._lease_ids = itertools.count(1)
+        self.released = 0   # leases that expired and were handed out again
+
+    def add_target(self, target_id: int, prev_uri: str, next_uri: str):
+        prev_time, next_time, base_url = extract_time_range(prev_uri, next_uri, target_id)
+        seconds = window_size(prev_time, next_time)
+        neighbor_ids = extract_neighbor_ids(prev_uri, next_uri)
+        estimate = estimate_offset(target_id, *neighbor_ids, seconds) if neighbor_ids else 0
+        bounds = [(lo, min(lo + self.shard_seconds, seconds)) for lo in range(0, seconds, self.shard_seconds)]
+        # Shards in order of their distance from the estimate, the one containing it first
+        bounds.sort(key=lambda b: 0 if b[0] <= estimate < b[1] else min(abs(b[0] - estimate), abs(b[1] - 1 - estimate)))
+        with self._lock:
+            self._targets[target_id] = _Target(target_id, prev_uri, next_uri, prev_time,
+                                               seconds * len(self.extensions), len(bounds))
+            for rank, (lo, hi) in enumerate(bounds):
+                shard = Shard(next(self._shard_ids), target_id, base_url, prev_time, lo, hi, estimate,
+                              self.extensions)
+                heapq.heappush(self._queue, (rank, shard.shard_id, shard))
+
+    @property
+    def finished(self) -> bool:
+        with self._lock:
+            return all(target.done for target in self._targets.values())
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until every target is finished."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._finished:
+            while not all(target.done for target in self._targets.values()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._finished.wait(remaining)
+        return True
+
+    def _expire(self, now: float):
+        for lease_id, lease in list(self._leases.items()):
+            if lease.expires < now:
+                del self._leases[lease_id]
+                if not self._targets[lease.shard.target_id].done:
+                    heapq.heappush(self._queue, (-1, lease.shard.shard_id, lease.shard))
+                    self.released += 1
+
+    def lease(self, worker: str) -> dict:
+        """The next shard for worker, {'wait': seconds} while others finish, or {'done': True}."""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            while self._queue:
+                _, _, shard = heapq.heappop(self._queue)
+                if self._targets[shard.target_id].done:
+                    continue
+                lease_id = str(next(self._lease_ids))
+                self._leases[lease_id] = _Lease(shard, worker, now + self.lease_seconds)
+                return {'lease': lease_id, 'shard': shard.to_json(), 'ttl': self.lease_seconds}
+            if all(target.done for target in self._targets.values()):
+                return {'done': True}
+            # Shards are still leased; one may expire and come back
+            return {'wait': min(1.0, self.lease_seconds / 3)}
+
+    def renew(self, lease_id: str, checked: int = 0) -> dict:
+        """Extend a lease; 'stop' tells the worker to abandon the shard."""
+        with self._lock:
+            lease = self._leases.get(lease_id)
+            if lease is None:
+                return {'ok': False, 'stop': True}
+            if self._targets[lease.shard.target_id].done:
+                del self._leases[lease_id]
+                return {'ok': False, 'stop': True}
+            lease.expires = time.monotonic() + self.lease_seconds
+            lease.checked = checked
+            return {'ok': True, 'stop': False}
+
+    def complete(self, lease_id: str, probes: int = 0, hit: Optional[dict] = None,
+                 unresolved: Sequence[Sequence] = ()) -> dict:
+        """
+        Record a swept shard. Results of expired or abandoned leases still count a hit.
+        unresolved lists the (offset, extension) candidates the worker got no answer for.
+        """
+        finished = None
+        with self._lock:
+            lease = self._leases.pop(lease_id, None)
+            if lease is None and hit is None:
+                return {'ok': False}
+            target_id = lease.shard.target_id if lease else hit['target']
+            target = self._targets.get(target_id)
+            if target is None or target.done:
+                return {'ok': False}
+            target.probes += probes
+            target.unresolved.extend((int(offset), ext) for offset, ext in unresolved)
+            if hit is not None:
+                target.hit = hit
+                target.done = True
+                # Drop the target's other leases; their workers are told to stop when renewing
+                for other_id, other in list(self._leases.items()):
+                    if other.shard.target_id == target_id:
+                        del self._leases[other_id]
+            elif lease is not None:
+                target.shards_left -= 1
+                target.done = target.shards_left <= 0
+            if target.done:
+                finished = self._record(target)
+                self._finished.notify_all()
+        if finished is not None:
+            if finished['status'] == STATUS_FOUND:
+                record_format_hit(finished['format'])
+            if self.on_finish:
+                self.on_finish(finished)
+        return {'ok': True}
+
+    def _record(self, target: _Target) -> dict:
+        record = {'artwork_id': target.target_id, 'status': STATUS_NOT_FOUND, 'url': None, 'timestamp': None,
+                  'format': None, 'probes': target.probes, 'elapsed': round(time.time() - target.started, 3),
+                  'prev_uri': target.prev_uri, 'next_uri': target.next_uri}
+        if target.unresolved and not target.hit:
+            record.update(status=STATUS_INCOMPLETE, unresolved=[
+                f"{target.start + datetime.timedelta(seconds=offset):%Y-%m-%d %H:%M:%S} {ext}"
+                for offset, ext in sorted(target.unresolved)])
+        if target.hit:
+            record.update(status=STATUS_FOUND, url=target.hit['url'], format=target.hit['extension'],
+                          timestamp=(target.start + datetime.timedelta(seconds=target.hit['offset'])).isoformat())
+        return record
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                'targets': len(self._targets),
+                'finished': sum(1 for target in self._targets.values() if target.done),
+                'found': sum(1 for target in self._targets.values() if target.hit),
+                'queued_shards': len(self._queue),
+                'leases': {lease_id: {'worker': lease.worker, 'target': lease.shard.target_id,
+                                      'shard': [lease.shard.lo, lease.shard.hi], 'checked': lease.checked}
+                           for lease_id, lease in self._leases.items()},
+                'released': self.released,
+            }
+
+    def serve(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+        """Answer POST /lease, /renew and /complete (JSON bodies) and GET /status from a daemon thread."""
+        coordinator = self
+        routes = {
+            '/lease': lambda body: coordinator.lease(body.get('worker', '?')),
+            '/renew': lambda body: coordinator.renew(body['lease'], body.get('checked', 0)),
+            '/complete': lambda body: coordinator.complete(body['lease'], body.get('probes', 0), body.get('hit'),
+                                                         body.get('unresolved', ())),
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/status':
+                    self.send_error(404)
+                    return
+                self._reply(coordinator.status())
+
+            def do_POST(self):
+                route = routes.get(self.path)
+                if route is None:
+                    self.send_error(404)
+                    return
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                    reply = route(body)
+                except (ValueError, KeyError) as e:
+                    self.send_error(400, str(e))
+                    return
+                self._reply(reply)
+
+            def _reply(self, data: dict):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def shard_candidates(shard: Shard):
+    """The shard's (url, (offset, ext)) candidates, outward from the estimate clamped into the shard."""
+    center = min(max(shard.estimate, shard.lo), shard.hi - 1) - shard.lo
+
+    def timestamps():
+        offsets = (shard.lo + offset for offset in order_offsets(shard.hi - shard.lo, center, TIME_SPIRAL))
+        return window_times(shard.start, offsets)
+
+    for (offset, time_for_url), ext in schedule_candidates(timestamps, shard.extensions, ORDER_INTERLEAVED):
+        yield f"{shard.base_url.replace('{time}', time_for_url)}.{ext}", (offset, ext)
+
+
+def run_worker(coordinator_url: str, name: Optional[str] = None, concurrency: int = DEFAULT_CONCURRENCY,
+               stop: Optional[threading.Event] = None) -> int:
+    """
+    Lease and sweep shards until the coordinator has none left.
+
+    A background thread renews the lease while the shard is probed and stops
+    the engine when the coordinator says so. Returns the number of shards swept.
+    """
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    session = requests.Session()
+    coordinator_url = coordinator_url.rstrip('/')
+
+    def call(path: str, body: dict) -> dict:
+        response = session.post(coordinator_url + path, json=body, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    swept = 0
+    while stop is None or not stop.is_set():
+        reply = call('/lease', {'worker': name})
+        if reply.get('done'):
+            break
+        if 'wait' in reply:
+            time.sleep(reply['wait'])
+            continue
+        lease_id, shard = reply['lease'], Shard.from_json(reply['shard'])
+        print(f"[{name}] 作品 {shard.target_id} 第 {shard.lo}-{shard.hi} 秒")
+
+        engine = ProbeEngine(concurrency=concurrency)
+        checked = 0
+        renewing = threading.Event()
+        abandoned = threading.Event()
+
+        def renew_loop():
+            while not renewing.wait(reply['ttl'] / 3):
+                try:
+                    if call('/renew', {'lease': lease_id, 'checked': checked}).get('stop'):
+                        abandoned.set()
+                except requests.exceptions.RequestException:
+                    pass   # 协调器暂时无法访问，租约到期前继续
+                if stop is not None and stop.is_set():
+                    abandoned.set()
+                if abandoned.is_set():
+                    engine.stop()
+                    return
+
+        def on_result(probe):
+            nonlocal checked
+            checked += 1
+
+        renewer = threading.Thread(target=renew_loop, daemon=True)
+        renewer.start()
+        try:
+            hits = engine.run(shard_candidates(shard), on_result=on_result)
+        finally:
+            renewing.set()
+            renewer.join()
+        hit = None
+        if hits:
+            offset, ext = hits[0].meta
+            hit = {'target': shard.target_id, 'url': hits[0].url, 'offset': offset, 'extension': ext}
+            print(f"[{name}] ✅ 找到作品 {shard.target_id}: {hits[0].url}")
+        if hit or not abandoned.is_set():
+            call('/complete', {'lease': lease_id, 'probes': engine.metrics.requests, 'hit': hit,
+                               'unresolved': [list(probe.meta) for probe in engine.unresolved]})
+        swept += 1
+    return swept
+
+
+def resolve_job(target_id: int, prev_uri: Optional[str], next_uri: Optional[str],
+                index: TimeIndex) -> Optional[Tuple[str, str]]:
+    """Neighbor URIs for a job, from the line itself, the time index or the adjacent artworks."""
+    if prev_uri and next_uri:
+        return prev_uri, next_uri
+    known = index.bracket_uris(target_id, max_window=INDEX_WINDOW_LIMIT)
+    if known:
+        return known
+    prev_id, next_id = find_adjacent_valid_artworks(target_id, on_page=index.add_page)
+    prev_info = fetch_artwork_info(prev_id) if prev_id else None
+    next_info = fetch_artwork_info(next_id) if next_id else None
+    if not prev_info or not next_info:
+        return None
+    return prev_info.uri, next_info.uri
+
+
+def spawn_workers(count: int, coordinator_url: str, concurrency: int, rate: float,
+                  mock_url: Optional[str] = None) -> List[subprocess.Popen]:
+    """Start count local worker processes running this module's work command."""
+    command = [sys.executable, os.path.abspath(__file__), 'work', coordinator_url,
+               '-c', str(concurrency), '-r', str(rate)]
+    if mock_url:
+        command += ['--mock-url', mock_url]
+    return [subprocess.Popen(command + ['--name', f"local-{i}"]) for i in range(count)]
+
+
+def use_mock(base_url: Optional[str]):
+    """Send i.pximg.net and www.pixiv.net requests to a mock_pixiv.py server."""
+    if base_url:
+        http_client.set_host_override('i.pximg.net', base_url)
+        http_client.set_host_override('www.pixiv.net', base_url)
+
+
+def serve_main(args) -> int:
+    use_mock(args.mock_url)
+    jobs = read_jobs(args.targets)
+    finished = load_finished(args.output)
+    pending = [job for job in jobs if job[0] not in finished]
+    print(f"共 {len(jobs)} 个作品，已完成 {len(jobs) - len(pending)} 个，待处理 {len(pending)} 个")
+
+    writer = ResultWriter(args.output)
+    index = TimeIndex()
+
+    def on_finish(record: dict):
+        writer.write(record)
+        if record['status'] == STATUS_FOUND:
+            index.add(record['artwork_id'], datetime.datetime.fromisoformat(record['timestamp']))
+            print(f"[{record['artwork_id']}] found -> {record['url']} ({record['probes']} probes)")
+        else:
+            print(f"[{record['artwork_id']}] {record['status']} ({record['probes']} probes)")
+
+    coordinator = Coordinator([ext.strip().lower() for ext in args.formats.split(',') if ext.strip()],
+                              shard_seconds=args.shard_seconds, lease_seconds=args.lease_seconds,
+                              on_finish=on_finish)
+    for artwork_id, prev_uri, next_uri in pending:
+        try:
+            uris = resolve_job(artwork_id, prev_uri, next_uri, index)
+            if uris is None:
+                writer.write({'artwork_id': artwork_id, 'status': STATUS_NEEDS_URIS})
+                continue
+            index.add_uri(uris[0])
+            index.add_uri(uris[1])
+            coordinator.add_target(artwork_id, *uris)
+        except Exception as e:
+            writer.write({'artwork_id': artwork_id, 'status': STATUS_ERROR, 'error': f"{type(e).__name__}: {e}"})
+    index.save()
+
+    server = coordinator.serve(args.host, args.port)
+    url = f"http://{args.host}:{server.server_address[1]}"
+    print(f"协调器地址: {url}  (状态: {url}/status)")
+    workers = spawn_workers(args.workers, url, args.concurrency, args.rate, args.mock_url) if args.workers else []
+    try:
+        coordinator.wait()
+        # 让仍在运行的工作进程在下次续租时收到停止通知并退出
+        for worker in workers:
+            worker.wait(timeout=args.lease_seconds)
+    except KeyboardInterrupt:
+        return 130
+    except subprocess.TimeoutExpired:
+        pass
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+        server.shutdown()
+        index.save()
+        writer.close()
+        status = coordinator.status()
+        print(f"完成 {status['finished']}/{status['targets']} 个作品，找到 {status['found']} 个，"
+              f"重新分配的租约 {status['released']} 个")
+    return 0
+
+
+def work_main(args) -> int:
+    use_mock(args.mock_url)
+    http_client.set_rate_controller(AdaptiveRateController(
+        initial_rate=min(100.0, args.rate), max_rate=args.rate, max_concurrency=args.concurrency))
+    try:
+        swept = run_worker(args.coordinator, args.name, args.concurrency)
+    except KeyboardInterrupt:
+        return 130
+    except requests.exceptions.RequestException as e:
+        # 协调器已退出
+        print(f"无法连接协调器: {e}")
+        return 1
+    print(f"[{args.name or os.getpid()}] 共完成 {swept} 个分片")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split searches into shards swept by worker processes "
+                                                 "on this and other hosts.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help="run the coordinator for a targets file (same format as batch.py)")
+    serve.add_argument('targets', help="file with one 'ID' or 'ID, prev URI, next URI' per line")
+    serve.add_argument('-o', '--output', default='results.jsonl',
+                       help="results file; finished jobs in it are skipped on restart")
+    serve.add_argument('-f', '--formats', default=','.join(DEFAULT_EXTENSIONS),
+                       help="comma separated file formats to search")
+    serve.add_argument('--host', default='127.0.0.1', help="address to listen on; 0.0.0.0 for remote workers")
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve.add_argument('--shard-seconds', type=int, default=DEFAULT_SHARD_SECONDS, help="seconds of a window per shard")
+    serve.add_argument('--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS,
+                       help="a shard whose worker has not checked in for this long is handed out again")
+    serve.add_argument('-w', '--workers', type=int, default=0, help="also start this many local worker processes")
+
+    work = commands.add_parser('work', help="sweep shards leased from a coordinator")
+    work.add_argument('coordinator', help="coordinator URL, e.g. http://127.0.0.1:8765")
+    work.add_argument('--name', default=None, help="worker name shown in the coordinator status")
+
+    for command in (serve, work):
+        command.add_argument('-c', '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                             help="concurrent requests per worker")
+        command.add_argument('-r', '--rate', type=float, default=500.0,
+                             help="maximum requests per second per worker")
+        command.add_argument('--mock-url', default=None,
+                             help="send i.pximg.net and www.pixiv.net requests to this mock_pixiv.py server instead")
+
+    args = parser.parse_args(argv)
+    return serve_main(args) if args.command == 'serve' else work_main(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import bisect
+import datetime
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from typing import Optional, Tuple
+
+from page_parser import parse_artwork_page, parse_illust_json
+from scheduler import parse_uri_datetime, URL_TIME_FORMAT
+
+DEFAULT_INDEX_FILE = 'time_index.bin'
+
+# A known bracket narrower than this (in seconds) is used without looking up the adjacent artworks
+INDEX_WINDOW_LIMIT = 3600
+
+_MAGIC = b'PXTI'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIQ')
+_EPOCH = datetime.datetime(1970, 1, 1)
+_ID_PATTERN = re.compile(r'/(\d+)_p\d+')
+
+Entry = Tuple[int, datetime.datetime]
+
+
+def index_uri(artwork_id: int, upload_time: datetime.datetime) -> str:
+    """An img-master URI carrying artwork_id and upload_time, usable wherever a neighbor URI is expected."""
+    return (f"https://i.pximg.net/img-master/img/{upload_time.strftime(URL_TIME_FORMAT)}/"
+            f"{artwork_id}_p0_master1200.jpg")
+
+
+class TimeIndex:
+    """
+    Persistent map from artwork ID to upload time, kept as two sorted arrays.
+
+    Every mapping learned along the way (neighbor URIs, artwork pages, search
+    hits) is added here. Because IDs rise with upload time, the nearest known
+    IDs below and above a new target bracket its upload time without any
+    request. Lookups are bisect searches over the ID array; the file is the
+    two arrays written back to back.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_FILE):
+        self.path = path
+        self._ids = array('q')
+        self._times = array('q')   # seconds since 1970-01-01 of the (JST) upload time in the URI
+        self._lock = threading.Lock()
+        self._dirty = False
+        if os.path.exists(path):
+            try:
+                self._load()
+            except (OSError, ValueError, struct.error) as e:
+                # 损坏或被截断的索引不影响启动，从空索引开始，下次保存时覆盖
+                print(f"⚠️ 无法读取时间索引 {path}，使用空索引: {e}")
+                self._ids, self._times = array('q'), array('q')
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        magic, version, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{self.path} is not a time index file")
+        ids, times = array('q'), array('q')
+        size = count * ids.itemsize
+        if len(data) != _HEADER.size + 2 * size:
+            raise ValueError(f"{self.path} is truncated: {len(data)} bytes for {count} entries")
+        ids.frombytes(data[_HEADER.size:_HEADER.size + size])
+        times.frombytes(data[_HEADER.size + size:_HEADER.size + 2 * size])
+        if sys.byteorder != 'little':
+            ids.byteswap()
+            times.byteswap()
+        self._ids, self._times = ids, times
+
+    def save(self):
+        """Write the index to disk if it changed, atomically."""
+        with self._lock:
+            if not self._dirty:
+                return
+            ids, times = array('q', self._ids), array('q', self._times)
+            self._dirty = False
+        if sys.byteorder != 'little':
+            ids.byteswap()
+            times.byteswap()
+        # A unique temporary file in the same directory, so two processes saving
+        # at once cannot interleave, and a crash leaves the old file in place
+        fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.',
+                                         dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, _VERSION, len(ids)))
+                f.write(ids.tobytes())
+                f.write(times.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def add(self, artwork_id: int, upload_time: datetime.datetime):
+        """Record an artwork's upload time, replacing any earlier value."""
+        seconds = int((upload_time - _EPOCH).total_seconds())
+        with self._lock:
+            i = bisect.bisect_left(self._ids, artwork_id)
+            if i < len(self._ids) and self._ids[i] == artwork_id:
+                if self._times[i] == seconds:
+                    return
+                self._times[i] = seconds
+            else:
+                self._ids.insert(i, artwork_id)
+                self._times.insert(i, seconds)
+            self._dirty = True
+
+    def add_uri(self, uri: str) -> Optional[Entry]:
+        """Record the ID and upload time carried by an i.pximg.net URI, if it has both."""
+        match = _ID_PATTERN.search(uri)
+        upload_time = parse_uri_datetime(uri)
+        if not match or upload_time is None:
+            return None
+        self.add(int(match.group(1)), upload_time)
+        return int(match.group(1)), upload_time
+
+    def add_page(self, artwork_id: int, content: str):
+        """Record the upload time in a fetched artwork page or illust JSON response."""
+        if content.lstrip().startswith('{'):
+            info = parse_illust_json(content, artwork_id)
+        else:
+            info = parse_artwork_page(content, artwork_id)
+        if info is not None:
+            self.add(artwork_id, info.upload_time)
+
+    def get(self, artwork_id: int) -> Optional[datetime.datetime]:
+        with self._lock:
+            i = bisect.bisect_left(self._ids, artwork_id)
+            if i < len(self._ids) and self._ids[i] == artwork_id:
+                return _EPOCH + datetime.timedelta(seconds=self._times[i])
+        return None
+
+    def bracket(self, target_id: int) -> Tuple[Optional[Entry], Optional[Entry]]:
+        """
+        The nearest known artworks below and above target_id (either may be None).
+
+        Returns (None, None) when the two disagree with ID order, e.g. when an
+        updated artwork's URI carries a later time than its ID implies.
+        """
+        with self._lock:
+            i = bisect.bisect_left(self._ids, target_id)
+            j = bisect.bisect_right(self._ids, target_id)
+            below = (self._ids[i - 1], self._times[i - 1]) if i > 0 else None
+            above = (self._ids[j], self._times[j]) if j < len(self._ids) else None
+        if below and above and below[1] > above[1]:
+            return None, None
+        return tuple(None if entry is None else (entry[0], _EPOCH + datetime.timedelta(seconds=entry[1]))
+                     for entry in (below, above))
+
+    def bracket_uris(self, target_id: int, max_window: Optional[int] = None) -> Optional[Tuple[str, str]]:
+        """
+        Neighbor URIs for target_id from the index alone, or None when it has no
+        bracket on both sides or the bracket is wider than max_window seconds.
+        """
+        below, above = self.bracket(target_id)
+        if below is None or above is None:
+            return None
+        if max_window is not None and (above[1] - below[1]).total_seconds() > max_window:
+            return None
+        return index_uri(*below), index_uri(*above)